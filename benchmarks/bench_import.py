@@ -0,0 +1,197 @@
+"""End to end benchmark of run.main against the in-memory Flywheel fake.
+
+Each size runs in its own process so peak RSS is measured per run.  Reports wall
+time, time to the first metadata write, API calls (per SDK method and time per phase
+with --verbose, from the gear's own API stats), requests the fake throttled, failed rows and peak RSS.  Shard processes work on copies of the fake project, their writes are not
+visible to later runs.
+
+    python benchmarks/bench_import.py                       # 1k, 10k and 100k rows
+    python benchmarks/bench_import.py --sizes 1000 --latency 0.01 --config max_workers=8
+    python benchmarks/bench_import.py --files              # map files instead of acquisitions
+    python benchmarks/bench_import.py --sizes 50 --project-size 100000   # small CSV, big project
+    python benchmarks/bench_import.py --repeat 2 --config snapshot_dir=/tmp/snapshot
+    python benchmarks/bench_import.py --sizes 20000 --latency 0.002 --config shards=4
+    python benchmarks/bench_import.py --sizes 1000 --config mapping_type=path   # or id
+    python benchmarks/bench_import.py --sizes 5000 --latency 0.01 --capacity 6 --config max_workers=32
+"""
+import argparse
+import csv
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+repo_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_dir))
+sys.path.insert(0, str(repo_dir / 'tests'))
+
+import fake_flywheel as ff
+
+
+def parse_overrides(overrides):
+    config = {}
+    for override in overrides:
+        key, value = override.split('=', 1)
+        try:
+            config[key] = json.loads(value)
+        except ValueError:
+            config[key] = value
+    return config
+
+
+def write_csv(path, labels):
+    rng = random.Random(0)
+    with open(path, 'w') as csv_file:
+        csv_file.write('label,score,rating,site,visit,notes,flag\n')
+        for label in labels:
+            csv_file.write(f"{label},{rng.randint(0, 100)},{rng.random():.4f},"
+                           f"site-{rng.randint(1, 9)},{rng.randint(1, 4)},"
+                           f"note {rng.randint(0, 10 ** 6)},{rng.choice(['yes', 'no'])}\n")
+
+
+def current_rss_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def run_once(rows, files, latency, overrides, log_file=None, project_size=None, repeat=1,
+             capacity=None):
+    # Repeated runs reuse the same fake project, like repeated gear jobs would
+    ff.install_fakes()
+    import run
+
+    fw, analysis, labels = ff.build_fake(rows, files, latency, project_size,
+                                      overrides.get('mapping_type', 'label'), capacity)
+    run.flywheel.Client = lambda *args, **kwargs: fw
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        csv_path = work_dir / 'benchmark.csv'
+        write_csv(csv_path, labels)
+
+        config = ff.manifest_defaults()
+        config.update({
+            'container_type': 'acquisition',
+            'attached_files': files,
+            'mapping_column': 'label',
+            'overwrite': True,
+        })
+        config.update(overrides)
+        config = {k: v for k, v in config.items() if v is not None}
+
+        for run_number in range(repeat):
+            output_dir = work_dir / f'output_{run_number}'
+            output_dir.mkdir()
+            context = ff.FakeGearContext(config,
+                                         {'csv_file': str(csv_path)},
+                                         {'id': analysis['id'], 'type': 'analysis'},
+                                         output_dir,
+                                         log_file)
+
+            fw.api_client.calls.clear()
+            fw.api_client.first_write = None
+            fw.api_client.throttled = 0
+            setup_rss = current_rss_mb()
+            start = time.perf_counter()
+            result = run.main(context)
+            wall_time = time.perf_counter() - start
+            # The gear's own stats include calls made by shard processes
+            with open(output_dir / 'Data_Import_API_stats.json') as stats_file:
+                api_stats = json.load(stats_file)
+            with open(output_dir / 'Data_Import_Status_report.csv') as report_file:
+                statuses = [row['Gear_Status'] for row in csv.DictReader(report_file)]
+
+            results.append({
+                'rows': rows,
+                'run': run_number + 1,
+                'project_size': max(rows, project_size or 0),
+                'files': files,
+                'latency': latency,
+                'capacity': capacity,
+                'exit_code': result,
+                'failed_rows': statuses.count('Failed'),
+                'throttled': fw.api_client.throttled,
+                'wall_time': wall_time,
+                'first_write': (fw.api_client.first_write - start
+                                if fw.api_client.first_write is not None else None),
+                'rows_per_second': rows / wall_time if wall_time else None,
+                'api_calls': api_stats['total_calls'],
+                'api_calls_by_endpoint': {k: v['count'] for k, v in api_stats['calls'].items()},
+                'phases': api_stats['run_time']['phases'],
+                'setup_rss_mb': setup_rss,
+                'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--files', action='store_true', help="map files instead of acquisitions")
+    parser.add_argument('--project-size', type=int,
+                        help="number of acquisitions (or files) in the project, default: rows")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every fake API call")
+    parser.add_argument('--capacity', type=int,
+                        help="requests the fake site serves at once, the rest get a 429")
+    parser.add_argument('--config', nargs='*', default=[], metavar='KEY=VALUE',
+                        help="gear config overrides, values are parsed as JSON when possible")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="run the gear this many times against the same project")
+    parser.add_argument('--log-file', help="gear log destination (default: discarded)")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--verbose', action='store_true', help="show API calls per endpoint")
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    overrides = parse_overrides(args.config)
+
+    if args.single:
+        results = run_once(args.sizes[0], args.files, args.latency, overrides, args.log_file,
+                           args.project_size, args.repeat, args.capacity)
+        print(json.dumps(results))
+        return
+
+    results = []
+    for rows in args.sizes:
+        command = [sys.executable, __file__, '--single', '--sizes', str(rows),
+                   '--latency', str(args.latency), '--repeat', str(args.repeat),
+                   '--config', *args.config]
+        if args.files:
+            command.append('--files')
+        if args.project_size:
+            command.extend(['--project-size', str(args.project_size)])
+        if args.capacity:
+            command.extend(['--capacity', str(args.capacity)])
+        if args.log_file:
+            command.extend(['--log-file', args.log_file])
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.extend(json.loads(output.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'rows':>8} {'run':>4} {'wall (s)':>10} {'1st write':>10} {'rows/s':>10} "
+          f"{'API calls':>10} {'throttled':>10} {'failed':>8} {'setup RSS':>10} {'peak RSS':>10}  exit")
+    for r in results:
+        first_write = f"{r['first_write']:>10.2f}" if r['first_write'] is not None else f"{'-':>10}"
+        print(f"{r['rows']:>8} {r['run']:>4} {r['wall_time']:>10.2f} {first_write} "
+              f"{r['rows_per_second']:>10.0f} {r['api_calls']:>10} {r['throttled']:>10} "
+              f"{r['failed_rows']:>8} {r['setup_rss_mb']:>8.0f}MB "
+              f"{r['peak_rss_mb']:>8.0f}MB  {r['exit_code']}")
+        if args.verbose:
+            for endpoint, count in r['api_calls_by_endpoint'].items():
+                print(f"{'':>10}{count:>8}  {endpoint}")
+            for name, phase in r['phases'].items():
+                print(f"{'':>10}{phase['seconds']:>7.2f}s  {name}")
+
+
+if __name__ == "__main__":
+    main()
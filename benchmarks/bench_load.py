@@ -0,0 +1,144 @@
+"""Load time and memory of wide tracker-style CSVs read with pandas.
+
+Each measurement is a fresh process so peak RSS is its own.  Compares the old load
+(every column made object by df.where(pd.notnull(df), None), then one dict per row
+built up front) with the typed one (parsed dtypes, categoricals for repetitive text,
+nulls converted by prepare_records, row dicts built one at a time), optionally with a
+column_types spec.  Reports the time to load the frame, the time to produce every row
+dict the import sends, the frame's memory and peak RSS.
+
+    python benchmarks/bench_load.py                          # 20k rows x 120 columns
+    python benchmarks/bench_load.py --rows 50000 --columns 200 --repeat 3
+"""
+import argparse
+import json
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+repo_dir = Path(__file__).resolve().parent.parent
+modes = ['objects', 'typed', 'typed+spec']
+
+
+def column_kinds(columns):
+    # A third numbers, a quarter repetitive labels (sites, visits, yes/no), the rest
+    # ids, notes and mostly empty columns
+    kinds = ['int', 'float', 'int', 'label', 'float', 'label', 'note', 'sparse']
+    return [('id', 'id')] + [(f"{kinds[i % len(kinds)]}_{i}", kinds[i % len(kinds)])
+                             for i in range(columns - 1)]
+
+
+def write_tracker(path, rows, columns):
+    rng = random.Random(0)
+    kinds = column_kinds(columns)
+    labels = ['baseline', 'week 4', 'week 12', 'follow up', 'yes', 'no', 'site A', 'site B']
+    with open(path, 'w') as csv_file:
+        csv_file.write(','.join(name for name, _ in kinds) + '\n')
+        for row in range(rows):
+            values = []
+            for _, kind in kinds:
+                missing = rng.random() < 0.1
+                if kind == 'id':
+                    values.append(f"{row:06d}")
+                elif missing or (kind == 'sparse' and rng.random() < 0.9):
+                    values.append('')
+                elif kind == 'int':
+                    values.append(str(rng.randint(0, 500)))
+                elif kind == 'float':
+                    values.append(f"{rng.random() * 100:.3f}")
+                elif kind == 'label':
+                    values.append(rng.choice(labels))
+                else:
+                    values.append(f"note {rng.randint(0, 10 ** 9)}")
+            csv_file.write(','.join(values) + '\n')
+    return kinds
+
+
+def run_single(csv_path, mode, columns):
+    sys.path.insert(0, str(repo_dir))
+    import pandas as pd
+    from utils import load_data as ld, import_data as id
+
+    spec = {}
+    if mode == 'typed+spec':
+        types = {'id': 'str', 'int': 'int', 'float': 'float', 'label': 'category'}
+        spec = {name: types[kind] for name, kind in column_kinds(columns) if kind in types}
+
+    start = time.perf_counter()
+    if mode == 'objects':
+        df = pd.read_table(csv_path, delimiter=',', header=0)
+        df = df.where(pd.notnull(df), None)
+    else:
+        df = ld.load_text_dataframe(csv_path, 1, ',', spec)
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    records = id.prepare_records(df)
+    if mode == 'objects':
+        records = list(records)
+    for row in records:
+        pass
+    records_seconds = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'rows': len(records),
+        'load_seconds': load_seconds,
+        'records_seconds': records_seconds,
+        'frame_mb': df.memory_usage(deep=True).sum() / 2 ** 20,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--columns', type=int, default=120)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="runs per mode, the median is reported")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--single', nargs=3, metavar=('CSV', 'MODE', 'COLUMNS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single[0], args.single[1], int(args.single[2]))))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        csv_path = Path(work_dir) / 'tracker.csv'
+        write_tracker(csv_path, args.rows, args.columns)
+        for mode in modes:
+            runs = []
+            for _ in range(args.repeat):
+                output = subprocess.run([sys.executable, __file__, '--single', str(csv_path), mode,
+                                         str(args.columns)],
+                                        check=True, capture_output=True, text=True).stdout
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+            result = dict(runs[0])
+            for key in ['load_seconds', 'records_seconds', 'frame_mb', 'peak_rss_mb']:
+                result[key] = statistics.median(r[key] for r in runs)
+            results.append(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.rows} rows x {args.columns} columns")
+    print(f"{'mode':>11} {'load (s)':>9} {'records (s)':>12} {'total (s)':>10} {'frame':>9} "
+          f"{'peak RSS':>9}")
+    for r in results:
+        print(f"{r['mode']:>11} {r['load_seconds']:>9.2f} {r['records_seconds']:>12.2f} "
+              f"{r['load_seconds'] + r['records_seconds']:>10.2f} {r['frame_mb']:>7.0f}MB "
+              f"{r['peak_rss_mb']:>7.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
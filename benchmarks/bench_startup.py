@@ -0,0 +1,114 @@
+"""Start up cost of small imports against the in-memory Flywheel fake.
+
+Each run is a fresh interpreter, so module imports are paid again like in a gear job.
+Reports the time to import run.py, the time run.main takes for a small CSV, and whether
+pandas / numpy / openpyxl were loaded, with the csv module fast path and with pandas
+(small_file_rows = 0).  The fake stands in for the flywheel SDK, whose own import time
+comes on top in both modes.
+
+    python benchmarks/bench_startup.py                      # 50 and 200 rows
+    python benchmarks/bench_startup.py --rows 200 10000 --repeat 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+repo_dir = Path(__file__).resolve().parent.parent
+heavy_modules = ['pandas', 'numpy', 'openpyxl']
+
+
+def run_single(rows, mode):
+    sys.path.insert(0, str(repo_dir))
+    sys.path.insert(0, str(repo_dir / 'tests'))
+    import fake_flywheel as ff
+    import bench_import as bi
+
+    ff.install_fakes()
+    fw, analysis, labels = ff.build_fake(rows, False, 0.0)
+
+    start = time.perf_counter()
+    import run
+    from utils import load_data as ld
+    import_seconds = time.perf_counter() - start
+
+    run.flywheel.Client = lambda *args, **kwargs: fw
+    if mode == 'pandas':
+        ld.small_file_rows = 0
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        csv_path = work_dir / 'benchmark.csv'
+        bi.write_csv(csv_path, labels)
+
+        config = ff.manifest_defaults()
+        config.update({'container_type': 'acquisition', 'mapping_column': 'label'})
+        config = {k: v for k, v in config.items() if v is not None}
+        context = ff.FakeGearContext(config,
+                                     {'csv_file': str(csv_path)},
+                                     {'id': analysis['id'], 'type': 'analysis'},
+                                     work_dir,
+                                     None)
+
+        start = time.perf_counter()
+        exit_code = run.main(context)
+        main_seconds = time.perf_counter() - start
+
+    return {
+        'rows': rows,
+        'mode': mode,
+        'exit_code': exit_code,
+        'import_seconds': import_seconds,
+        'main_seconds': main_seconds,
+        'heavy_modules': [m for m in heavy_modules if m in sys.modules],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs per size and mode, the median is reported")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--single', nargs=2, metavar=('ROWS', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(int(args.single[0]), args.single[1])))
+        return
+
+    results = []
+    for rows in args.rows:
+        for mode in ['fast', 'pandas']:
+            runs = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                output = subprocess.run([sys.executable, __file__, '--single', str(rows), mode],
+                                        check=True, capture_output=True, text=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                result['process_seconds'] = time.perf_counter() - start
+                runs.append(result)
+            result = dict(runs[0])
+            for key in ['import_seconds', 'main_seconds', 'process_seconds']:
+                result[key] = statistics.median(r[key] for r in runs)
+            results.append(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'rows':>8} {'mode':>7} {'import (s)':>11} {'main (s)':>9} {'import+main':>12} "
+          f"{'process (s)':>12}  exit  heavy modules loaded")
+    for r in results:
+        print(f"{r['rows']:>8} {r['mode']:>7} {r['import_seconds']:>11.3f} {r['main_seconds']:>9.3f} "
+              f"{r['import_seconds'] + r['main_seconds']:>12.3f} {r['process_seconds']:>12.3f}  "
+              f"{r['exit_code']:>4}  {', '.join(r['heavy_modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
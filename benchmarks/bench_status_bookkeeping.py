@@ -0,0 +1,83 @@
+"""Compare the old per-row status bookkeeping in import_data (df.iloc + pop + two
+boolean-mask df.loc assignments per row) with the record/list based loop.
+
+    python benchmarks/bench_status_bookkeeping.py --rows 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def make_frame(nrows, ncols=10):
+    data = {'label': [f"acq{i}" for i in range(nrows)]}
+    for col in range(ncols):
+        data[f"col{col}"] = np.random.rand(nrows)
+    return pd.DataFrame(data)
+
+
+def per_row_masks(df):
+    df['Gear_Status'] = 'Failed'
+    df['Gear_FW_Location'] = None
+    for row in range(len(df)):
+        upload_obj = df.iloc[row]
+        upload_obj.pop('Gear_Status')
+        upload_obj.pop('Gear_FW_Location')
+        df.loc[df.index == row, 'Gear_FW_Location'] = f"group/project/{upload_obj.get('label')}"
+        df.loc[df.index == row, 'Gear_Status'] = 'Success'
+    return df
+
+
+def records_and_lists(df):
+    records = df.to_dict('records')
+    statuses = ['Failed'] * len(records)
+    locations = [None] * len(records)
+    for position, upload_obj in enumerate(records):
+        locations[position] = f"group/project/{upload_obj.get('label')}"
+        statuses[position] = 'Success'
+    df['Gear_Status'] = statuses
+    df['Gear_FW_Location'] = locations
+    return df
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    func(df)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--old-rows', type=int, default=4000,
+                        help="The old loop takes minutes at 100k rows, so it is timed at this "
+                             "many rows and twice as many, fitted to a*n + b*n^2 and "
+                             "extrapolated to --rows.  Set equal to --rows to time it fully.")
+    args = parser.parse_args()
+
+    new_time = timed(records_and_lists, make_frame(args.rows))
+
+    print(f"rows:                {args.rows}")
+    print(f"records + lists:     {new_time:.3f}s")
+
+    if args.old_rows >= args.rows:
+        old_time = timed(per_row_masks, make_frame(args.rows))
+        print(f"per-row df.loc mask: {old_time:.3f}s")
+    else:
+        n1, n2 = args.old_rows, min(2 * args.old_rows, args.rows)
+        t1 = timed(per_row_masks, make_frame(n1))
+        t2 = timed(per_row_masks, make_frame(n2))
+        # Per-row iloc/Series overhead is linear, each boolean mask is linear in the
+        # frame size so the masks add a quadratic term.
+        quadratic = max((t2 * n1 - t1 * n2) / (n1 * n2 * (n2 - n1)), 0)
+        linear = (t1 - quadratic * n1 ** 2) / n1
+        old_time = linear * args.rows + quadratic * args.rows ** 2
+        print(f"per-row df.loc mask: {t1:.3f}s at {n1} rows, {t2:.3f}s at {n2} rows, "
+              f"~{old_time:.1f}s extrapolated")
+
+    print(f"speedup:             ~{old_time / new_time:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
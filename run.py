@@ -5,7 +5,10 @@ import sys
 import flywheel
 import flywheel_gear_toolkit as gt
 
-from utils import load_data as ld, import_data as id
+from utils import load_data as ld, import_data as id, flywheel_helpers as fh
+from utils import journal as jn, instrumentation, snapshot as sn, row_logging as rl
+from utils import batch_import as bi, pipeline as pl, rate_control as rc
+from utils import profiling, discovery, import_tables as it
 
 
 def main(context):
@@ -17,6 +20,8 @@ def main(context):
             api_key = inp["key"]
 
     fw = flywheel.Client(api_key)
+    api_stats = instrumentation.instrument_client(fw)
+    timer = instrumentation.PhaseTimer()
     
     # Setup basic logging and log the configuration for this job
     if config["gear_log_level"] == "INFO":
@@ -56,54 +61,294 @@ def main(context):
     mapping_column = config.get("mapping_column", 0)
     log.debug(f"Using column {mapping_column} to identify objects")
     
+    mapping_type = config.get("mapping_type", "label")
+    log.debug(f"Mapping column holds object {mapping_type}s")
+    
     overwrite = config.get("overwrite", False)
     log.debug(f"Overwrite set to {overwrite}")
     
     delimiter = config.get("delimiter", ",")
     log.debug(f"Using Delimiter: {delimiter}")
     
+    sheet_names = config.get("sheet_names", "")
+    log.debug(f"Excel sheets to import: {sheet_names or 'first sheet'}")
+    
     object_type = config.get("container_type")
     log.debug(f"Looking for matching labels for container type {object_type}")
     
     attached_files = config.get('attached_files')
     log.debug(f"looking for files attached to container type {attached_files}")
     
+    lookup_mode = config.get('lookup_mode', 'auto')
+    log.debug(f"Finding objects with lookup mode {lookup_mode}")
+    
+    auto_lookup_limit = config.get('auto_lookup_limit', 1000)
+    log.debug(f"Auto lookup mode targets CSVs with up to {auto_lookup_limit} names")
+    discovery.targeted_key_limit = auto_lookup_limit
+    
+    max_workers = config.get('max_workers', 4)
+    log.debug(f"Sending metadata updates with up to {max_workers} workers")
+    governor = rc.govern_client(fw, max_workers)
+    
+    pipeline = config.get('pipeline', False)
+    log.debug(f"Pipelined discovery and updates set to {pipeline}")
+    
+    shards = config.get('shards', 1)
+    log.debug(f"Splitting rows across {shards} processes" if shards > 1 else "Importing in one process")
+    
+    chunk_size = config.get('chunk_size', 0)
+    log.debug(f"Reading CSV in chunks of {chunk_size} rows" if chunk_size else "Reading whole CSV")
+    
+    resume = config.get('resume', False)
+    log.debug(f"Resume from previous journal set to {resume}")
+    
+    snapshot_dir = config.get('snapshot_dir', '')
+    log.debug(f"Hierarchy snapshot directory: {snapshot_dir or 'not used'}")
+    
+    log_format = config.get('log_format', 'verbose')
+    log.debug(f"Logging rows in {log_format} format")
+    
+    hierarchy_cache_size = config.get('hierarchy_cache_size', 0)
+    log.debug(f"Hierarchy cache size set to {hierarchy_cache_size or 'unbounded'}")
+    fh.reset_hierarchy_cache(hierarchy_cache_size or None)
+    
+    profile = config.get('profile', 'off')
+    log.debug(f"Profiler set to {profile}")
+    
+    column_types = config.get('column_types', '')
+    log.debug(f"Column types: {column_types or 'inferred'}")
+    
+    min_match_rate = config.get('min_match_rate', 0)
+    log.debug(f"Minimum match rate set to {min_match_rate}%")
+    
     destination_level = context.destination.get('type')
     if destination_level is None:
         log.error(f"invalid destination {destination_level}")
         return 1
     
-    try:
+    report_output = Path(context.output_dir)
+    journal_path = report_output / jn.journal_name
+    previous_journal = None
+    if resume:
+        previous_journal = context.get_input_path('resume_journal')
+        if previous_journal is None and journal_path.exists():
+            previous_journal = journal_path
+        
+        if previous_journal is None:
+            log.warning('resume is set but no previous journal was found. '
+                        'Importing all rows.')
+    
+    journal = jn.ImportJournal(journal_path, metadata_destination)
+    
+    snapshot = sn.HierarchySnapshot(Path(snapshot_dir) / sn.snapshot_name) if snapshot_dir else None
     
+    log_listener = None
+    profiler = None
+    try:
+        log_listener = rl.start_queue_logging() if log_format == 'compact' else None
+        profiler = profiling.start_profiler(profile)
+        
+        column_types = ld.parse_column_types(column_types)
+        
         destination_id = context.destination.get('id')
         dest_container = fw.get(destination_id)
         
-        df = ld.load_text_dataframe(csv_file, first_row, delimiter)
-        mapping_column = ld.validate_df(df, mapping_column)
+        batch = ld.is_zip_file(csv_file)
+        if shards > 1 and (batch or (chunk_size and not ld.is_excel_file(csv_file))):
+            log.info('shards only apply to a single CSV or Excel file read whole, '
+                     'importing in one process')
+        
+        if batch:
+            # Every table in the archive goes to its own destination, named after the file
+            if chunk_size:
+                log.info('chunk_size only applies to a single text file, reading whole tables')
+            with timer.phase('load'):
+                loaded = ld.load_zip_tables(csv_file, first_row, delimiter, sheet_names,
+                                            column_types)
+            with timer.phase('validate'):
+                destinations = it.zip_destinations([member for _, member, _ in loaded],
+                                                   config.get("metadata_destination"))
+                tables = [bi.Table(table_name,
+                                   df,
+                                   ld.validate_df(df, mapping_column, column_types),
+                                   destinations[member])
+                          for table_name, member, df in loaded]
         
-        objects_for_processing = id.get_objects_for_processing(fw,
-                                                               dest_container,
-                                                               object_type,
-                                                               attached_files)
+        elif ld.is_excel_file(csv_file):
+            if chunk_size:
+                log.info('chunk_size only applies to text files, reading whole sheets')
+            with timer.phase('load'):
+                sheets = ld.load_excel_sheets(csv_file, first_row, sheet_names, column_types)
+            with timer.phase('validate'):
+                tables = [bi.Table(sheet, df, ld.validate_df(df, mapping_column, column_types),
+                                   metadata_destination)
+                          for sheet, df in sheets.items()]
         
-        df = id.import_data(fw,
-                            df,
-                       mapping_column,
-                       objects_for_processing,
-                       attached_files,
-                       metadata_destination,
-                       overwrite,
-                       dry_run)
+        elif chunk_size:
+            with timer.phase('validate'):
+                mapping_column, keys = ld.validate_text_file(csv_file, first_row, delimiter,
+                                                             mapping_column, chunk_size,
+                                                             column_types)
+            
+            # Rows a previous job committed are neither looked up nor checked again
+            completed = it.load_completed(previous_journal, journal, metadata_destination)
+            pending = sorted(it.pending_keys(keys, completed), key=str)
+            objects_for_processing, container_index = it.discover_matches(
+                fw,
+                dest_container,
+                [(None, pending)],
+                object_type=object_type,
+                attached_files=attached_files,
+                lookup_mode=lookup_mode,
+                snapshot=snapshot,
+                mapping_type=mapping_type,
+                report_output=report_output,
+                min_match_rate=min_match_rate,
+                timer=timer)
+            
+            success_counter, nrows = it.import_in_chunks(
+                fw,
+                csv_file,
+                first_row=first_row,
+                delimiter=delimiter,
+                chunk_size=chunk_size,
+                mapping_column=mapping_column,
+                objects_for_processing=objects_for_processing,
+                container_index=container_index,
+                attached_files=attached_files,
+                metadata_destination=metadata_destination,
+                overwrite=overwrite,
+                dry_run=dry_run,
+                max_workers=max_workers,
+                report_output=report_output,
+                journal=journal,
+                completed=completed,
+                log_format=log_format,
+                nrows_expected=len(keys),
+                timer=timer,
+                column_types=column_types)
+            
+            id.log_final_report(success_counter, nrows, it.report_lines(api_stats, governor, timer))
+            return 0
         
-        report_output = context.output_dir
-        id.save_df_to_csv(df, report_output)
+        else:
+            with timer.phase('load'):
+                if pipeline or shards > 1:
+                    # Both split the rows with pandas
+                    df = ld.load_text_dataframe(csv_file, first_row, delimiter, column_types)
+                else:
+                    df = ld.load_text_table(csv_file, first_row, delimiter, column_types)
+            with timer.phase('validate'):
+                tables = [bi.Table(None, df, ld.validate_df(df, mapping_column, column_types),
+                                   metadata_destination)]
+        
+        if pipeline and (batch or len(tables) > 1 or shards > 1):
+            log.info('pipeline only applies to a single table imported in one process, '
+                     'discovering the project first')
+        
+        elif pipeline:
+            table = tables[0]
+            if min_match_rate:
+                log.info('min_match_rate is not checked with pipeline, rows are written '
+                         'while the project is still searched')
+            # Discovery overlaps the import, they are timed together
+            with timer.phase('discover + import'):
+                df = pl.import_pipelined(fw,
+                                         table.df,
+                                         table.mapping_column,
+                                         dest_container,
+                                         object_type,
+                                         attached_files,
+                                         table.destination,
+                                         overwrite,
+                                         dry_run,
+                                         max_workers,
+                                         lookup_mode,
+                                         snapshot,
+                                         journal,
+                                         it.load_completed(previous_journal, journal,
+                                                           metadata_destination, table.name),
+                                         log_format,
+                                         mapping_type)
+            timer.count('discover + import', len(df), 'rows')
+            
+            with timer.phase('report'):
+                df = id.add_sheet_column(df, table.name)
+                id.save_df_to_csv(df, report_output)
+            id.log_final_report(id.count_successes(df), len(df), it.report_lines(api_stats, governor, timer))
+            return 0
+        
+        # Every table is matched against one discovery of the project.  Rows a previous
+        # job committed are neither looked up nor checked again.
+        completed = {table.name: it.load_completed(previous_journal, journal, metadata_destination,
+                                                   table.name)
+                     for table in tables}
+        key_sets = [(table.name, it.pending_keys(table.df[table.mapping_column], completed[table.name]))
+                    for table in tables]
+        objects_for_processing, container_index = it.discover_matches(
+            fw,
+            dest_container,
+            key_sets,
+            object_type=object_type,
+            attached_files=attached_files,
+            lookup_mode=lookup_mode,
+            snapshot=snapshot,
+            mapping_type=mapping_type,
+            report_output=report_output,
+            min_match_rate=min_match_rate,
+            timer=timer)
+        
+        with timer.phase('import'):
+            if batch:
+                reports = bi.import_batch(fw,
+                                          tables,
+                                          container_index,
+                                          overwrite,
+                                          dry_run,
+                                          max_workers,
+                                          journal,
+                                          completed,
+                                          log_format)
+            else:
+                reports = it.import_sheets(fw,
+                                           tables,
+                                           objects_for_processing,
+                                           container_index,
+                                           attached_files,
+                                           overwrite,
+                                           dry_run,
+                                           max_workers,
+                                           journal,
+                                           completed,
+                                           log_format,
+                                           shards,
+                                           api_key,
+                                           api_stats,
+                                           mapping_type)
+        timer.count('import', sum(len(report) for report in reports), 'rows')
+        
+        with timer.phase('report'):
+            df = it.combine_reports(reports)
+            id.save_df_to_csv(df, report_output)
+        id.log_final_report(id.count_successes(df), len(df), it.report_lines(api_stats, governor, timer))
+        log.debug(f"Hierarchy cache: {fh.hierarchy_cache.hits} hits, "
+                  f"{fh.hierarchy_cache.misses} misses")
     
     except Exception as e:
         log.exception(e)
         return 1
+    
+    finally:
+        journal.close()
+        if snapshot is not None:
+            snapshot.close()
+        if profiler is not None:
+            profiling.stop_profiler(profiler, report_output)
+        api_stats.save(report_output, timer.summary())
+        if log_listener is not None:
+            rl.stop_queue_logging(log_listener)
      
     return 0
-    
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import csv
+import itertools
+import sys
+from pathlib import Path
+
+import pytest
+
+repo_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_dir))
+
+import fake_flywheel as ff
+from utils import load_data as ld
+
+ff.install_fakes()
+
+
+def read_report(output_dir):
+    with open(Path(output_dir) / 'Data_Import_Status_report.csv') as report_file:
+        return list(csv.DictReader(report_file))
+
+
+@pytest.fixture(params=['csv', 'pandas', 'chunks'])
+def reader(request, monkeypatch):
+    # The ways a CSV is read: the csv module for small files, pandas whole, or pandas a
+    # few rows at a time.  Returns the config that selects it.
+    if request.param != 'csv':
+        monkeypatch.setattr(ld, 'small_file_rows', 0)
+    return {'chunk_size': 4} if request.param == 'chunks' else {}
+
+
+@pytest.fixture
+def run_gear(tmp_path):
+    # Runs run.main against fw with the manifest defaults and config, every run writes
+    # to its own output directory.  Returns (exit code, output directory).
+    import run
+    
+    run_numbers = itertools.count()
+    
+    def run_gear(fw, analysis, csv_path, resume_journal=None, **config):
+        settings = ff.manifest_defaults()
+        settings.update({'container_type': 'acquisition', 'metadata_destination': 'imported'})
+        settings.update(config)
+        settings = {k: v for k, v in settings.items() if v is not None}
+        
+        output_dir = tmp_path / f"output_{next(run_numbers)}"
+        output_dir.mkdir()
+        inputs = {'csv_file': str(csv_path)}
+        if resume_journal is not None:
+            inputs['resume_journal'] = str(resume_journal)
+        context = ff.FakeGearContext(settings, inputs,
+                                     {'id': analysis['id'], 'type': 'analysis'}, output_dir)
+        
+        run.flywheel.Client = lambda *args, **kwargs: fw
+        return run.main(context), output_dir
+    
+    return run_gear
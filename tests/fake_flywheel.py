@@ -0,0 +1,392 @@
+"""In-memory stand-in for the parts of flywheel.Client and the gear toolkit context
+used by this gear, for the tests and benchmarks without a Flywheel instance.
+
+Every request the real SDK would send goes through FakeApiClient.call_api, which
+sleeps for the configured latency and counts the call per endpoint.  With a capacity,
+requests beyond that many at once are refused with a 429, like a throttling site.
+Like the SDK, finds and child listings return containers without info and files, only
+get_* and reload() return them in full.
+
+    fw = FakeClient(latency=0.005, capacity=8)
+    project = build_project(fw, subjects=100, sessions=5, acquisitions=4, files=2)
+
+install_fakes() lets run.py be imported without the SDK and toolkit, and build_fake
+makes a project with the mapping keys of a CSV that covers it.
+"""
+import collections
+import copy
+import datetime
+import itertools
+import json
+import logging
+import math
+import re
+import sys
+import threading
+import time
+import types
+from pathlib import Path
+
+repo_dir = Path(__file__).resolve().parent.parent
+
+page_size = 250
+# Shape of the projects build_fake makes
+sessions_per_subject = 4
+acquisitions_per_session = 5
+files_per_acquisition = 2
+
+_ids = itertools.count(1)
+
+
+def new_id():
+    return f"{next(_ids):024x}"
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class ApiException(Exception):
+    def __init__(self, status=None, reason=None, headers=None):
+        super().__init__(f"({status}) {reason}")
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class FakeApiClient:
+    def __init__(self, latency=0.0, capacity=None):
+        self.latency = latency
+        self.capacity = capacity
+        self.calls = collections.Counter()
+        self.throttled = 0
+        self.in_flight = 0
+        # perf_counter() of the first POST, for time to first write
+        self.first_write = None
+        self._lock = threading.Lock()
+
+    def call_api(self, resource_path, method, *args, **kwargs):
+        with self._lock:
+            self.calls[f"{method} {resource_path}"] += 1
+            if self.capacity and self.in_flight >= self.capacity:
+                self.throttled += 1
+                raise ApiException(429, 'Too Many Requests')
+            self.in_flight += 1
+            if method == 'POST' and self.first_write is None:
+                self.first_write = time.perf_counter()
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+
+class FakeModel(dict):
+    # SDK models allow both attribute and .get() access
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+
+class FakeContainer(FakeModel):
+    def __init__(self, fw, record, partial=False):
+        super().__init__()
+        object.__setattr__(self, '_fw', fw)
+        self._load(record, partial)
+
+    def _load(self, record, partial=False):
+        self.clear()
+        for key, value in record.items():
+            if key in ('children', 'files'):
+                continue
+            self[key] = copy.deepcopy(value)
+        self['parents'] = FakeModel(record['parents'])
+        self['files'] = [FakeFile(self._fw, f, self) for f in record['files']]
+        if partial:
+            self['info'] = None
+            self['files'] = None
+        if record['container_type'] == 'session':
+            subject = self._fw._store[record['parents']['subject']]
+            self['subject'] = FakeModel(id=subject['id'], label=subject['label'])
+
+    def reload(self):
+        self._fw._call(f"/{self.container_type}s/{{Id}}", 'GET')
+        self._load(self._fw._store[self.id])
+        return self
+
+    def update_info(self, info):
+        self._fw._call(f"/{self.container_type}s/{{Id}}/info", 'POST')
+        record = self._fw._store[self.id]
+        record['info'].update(copy.deepcopy(info))
+        record['modified'] = now()
+
+    def _children(self, level):
+        self._fw._call(f"/{self.container_type}s/{{Id}}/{level}s", 'GET')
+        return [FakeContainer(self._fw, self._fw._store[child_id], partial=True)
+                for child_id in self._fw._store[self.id]['children']]
+
+    def subjects(self):
+        return self._children('subject')
+
+    def sessions(self):
+        return self._children('session')
+
+    def acquisitions(self):
+        return self._children('acquisition')
+
+
+class FakeFile(FakeModel):
+    def __init__(self, fw, record, parent):
+        super().__init__()
+        object.__setattr__(self, '_fw', fw)
+        object.__setattr__(self, '_record', record)
+        object.__setattr__(self, 'parent', parent)
+        for key, value in record.items():
+            self[key] = copy.deepcopy(value)
+        self['container_type'] = 'file'
+
+    def update_info(self, info):
+        self._fw._call(f"/{self.parent.container_type}s/{{Id}}/files/{{FileName}}/info", 'POST')
+        self._record['info'].update(copy.deepcopy(info))
+
+
+class FakeFinder:
+    def __init__(self, fw, level):
+        self._fw = fw
+        self._level = level
+
+    def iter_find(self, filter_string=''):
+        # Supports comma separated "dotted.key=value", "dotted.key=|[a,b]" and
+        # "modified>=timestamp" filters
+        filters = []
+        since = None
+        for condition in re.split(r',(?![^\[]*\])', filter_string):
+            if condition.startswith('modified>='):
+                since = datetime.datetime.fromisoformat(condition.split('>=', 1)[1])
+            elif condition:
+                key, value = condition.split('=', 1)
+                if value.startswith('|['):
+                    filters.append((key, set(value[2:-1].split(','))))
+                else:
+                    filters.append((key, {value}))
+        # Lookups by id don't need to scan the whole store
+        ids = next((values for key, values in filters if key == '_id'), None)
+        candidates = ([self._fw._store[i] for i in sorted(ids) if i in self._fw._store]
+                      if ids is not None else self._fw._store.values())
+        matches = [r for r in candidates
+                   if r['container_type'] == self._level
+                   and all(_lookup(r, key) & values for key, values in filters)
+                   and (since is None or r['modified'] >= since)]
+
+        for start in range(0, max(len(matches), 1), page_size):
+            self._fw._call(f"/{self._level}s", 'GET')
+            for record in matches[start:start + page_size]:
+                yield FakeContainer(self._fw, record, partial=True)
+
+    def find(self, filter_string=''):
+        return list(self.iter_find(filter_string))
+
+
+def _lookup(record, dotted_key):
+    # Set of values at dotted_key, lists (like files) match on any element
+    if dotted_key == '_id':
+        dotted_key = 'id'
+    values = [record]
+    for key in dotted_key.split('.'):
+        next_values = []
+        for value in values:
+            value = value.get(key) if isinstance(value, dict) else None
+            next_values.extend(value if isinstance(value, list) else [value])
+        values = next_values
+    return {v for v in values if v is not None}
+
+
+class FakeClient:
+    def __init__(self, api_key=None, latency=0.0, capacity=None):
+        self.api_client = FakeApiClient(latency, capacity)
+        self._store = {}
+        self.subjects = FakeFinder(self, 'subject')
+        self.sessions = FakeFinder(self, 'session')
+        self.acquisitions = FakeFinder(self, 'acquisition')
+
+    def _call(self, resource_path, method):
+        self.api_client.call_api(resource_path, method)
+
+    def _get_level(self, container_id, level):
+        self._call(f"/{level}s/{{Id}}", 'GET')
+        record = self._store.get(container_id)
+        if record is None or (level and record['container_type'] != level):
+            raise ApiException(404, f"{level or 'container'} {container_id} not found")
+        return FakeContainer(self, record)
+
+    def get(self, container_id):
+        self._call("/containers/{Id}", 'GET')
+        record = self._store.get(container_id)
+        if record is None:
+            raise ApiException(404, f"container {container_id} not found")
+        return FakeContainer(self, record)
+
+    def get_group(self, group_id):
+        self._call("/groups/{Id}", 'GET')
+        return FakeModel(id=group_id, label=group_id, container_type='group')
+
+    def get_project(self, container_id):
+        return self._get_level(container_id, 'project')
+
+    def get_subject(self, container_id):
+        return self._get_level(container_id, 'subject')
+
+    def get_session(self, container_id):
+        return self._get_level(container_id, 'session')
+
+    def get_acquisition(self, container_id):
+        return self._get_level(container_id, 'acquisition')
+
+    def get_analysis(self, container_id):
+        return self._get_level(container_id, 'analysis')
+
+    def add_container(self, container_type, label, parent=None, group='benchmark', info=None):
+        parents = {'group': group, 'project': None, 'subject': None,
+                   'session': None, 'acquisition': None}
+        if parent is not None:
+            parents.update({k: v for k, v in parent['parents'].items() if v is not None})
+            parents[parent['container_type']] = parent['id']
+        record = {
+            'id': new_id(),
+            'label': label,
+            'container_type': container_type,
+            'parents': parents,
+            'info': info or {},
+            'files': [],
+            'children': [],
+            'modified': now(),
+        }
+        self._store[record['id']] = record
+        if parent is not None and container_type != 'analysis':
+            parent['children'].append(record['id'])
+        return record
+
+    def add_file(self, parent, name, info=None):
+        record = {'name': name, 'file_id': new_id(), 'info': info or {}}
+        parent['files'].append(record)
+        parent['modified'] = now()
+        return record
+
+
+def build_project(fw, subjects=10, sessions=2, acquisitions=2, files=0, label='benchmark'):
+    # Returns (project record, analysis record).  Labels are unique across the project
+    # so they can be used directly as mapping keys.
+    project = fw.add_container('project', label)
+    for sub in range(subjects):
+        subject = fw.add_container('subject', f"sub-{sub:05d}", project)
+        for ses in range(sessions):
+            session = fw.add_container('session', f"sub-{sub:05d}_ses-{ses:02d}", subject)
+            for acq in range(acquisitions):
+                acquisition = fw.add_container(
+                    'acquisition', f"sub-{sub:05d}_ses-{ses:02d}_acq-{acq:02d}", session)
+                for n in range(files):
+                    fw.add_file(acquisition, f"{acquisition['label']}_{n:02d}.nii.gz")
+    analysis = fw.add_container('analysis', 'import-metadata', project)
+    return project, analysis
+
+
+def record_path(fw, record):
+    # group/project/subject/session/acquisition, as the gear reports it
+    parents = record['parents']
+    labels = [fw._store[parents[level]]['label']
+              for level in ('project', 'subject', 'session') if parents[level]]
+    return '/'.join([parents['group']] + labels + [record['label']])
+
+
+def build_fake(rows, files, latency, project_size=None, mapping_type='label', capacity=None):
+    # Returns (client, analysis record, mapping keys of rows acquisitions or files
+    # spread over the project)
+    per_subject = sessions_per_subject * acquisitions_per_session
+    if files:
+        per_subject *= files_per_acquisition
+    subjects = math.ceil(max(rows, project_size or 0) / per_subject)
+
+    fw = FakeClient(latency=latency, capacity=capacity)
+    project, analysis = build_project(fw,
+                                      subjects=subjects,
+                                      sessions=sessions_per_subject,
+                                      acquisitions=acquisitions_per_session,
+                                      files=files_per_acquisition if files else 0)
+
+    # Mapping keys in the form the mapping_type config expects
+    acquisitions = [r for r in fw._store.values() if r['container_type'] == 'acquisition']
+    if mapping_type == 'id':
+        labels = ([f['file_id'] for r in acquisitions for f in r['files']] if files
+                  else [r['id'] for r in acquisitions])
+    elif mapping_type == 'path':
+        labels = ([f"{record_path(fw, r)}/{f['name']}" for r in acquisitions for f in r['files']]
+                  if files else [record_path(fw, r) for r in acquisitions])
+    else:
+        labels = ([f['name'] for r in acquisitions for f in r['files']] if files
+                  else [r['label'] for r in acquisitions])
+
+    # Spread the CSV rows over the whole project
+    labels = labels[::max(len(labels) // rows, 1)][:rows]
+    return fw, analysis, labels
+
+
+class FakeGearContext:
+    # The subset of flywheel_gear_toolkit.GearToolkitContext used by run.main
+    def __init__(self, config, inputs, destination, output_dir, log_file=None):
+        self.config = config
+        self.config_json = {
+            'inputs': {'key': {'base': 'api-key', 'key': 'fake-key'}},
+        }
+        self._inputs = inputs
+        self.destination = destination
+        self.output_dir = Path(output_dir)
+        self.log = logging.getLogger("__main__")
+        self._log_file = log_file
+
+    def init_logging(self, level):
+        handler = logging.FileHandler(self._log_file) if self._log_file else logging.NullHandler()
+        # basicConfig(force=True) needs Python 3.8
+        root = logging.getLogger()
+        for old_handler in root.handlers[:]:
+            root.removeHandler(old_handler)
+            old_handler.close()
+        logging.basicConfig(level=level.upper(), handlers=[handler])
+
+    def log_config(self):
+        for key, value in self.config.items():
+            self.log.info(f'Config "{key}={value}"')
+
+    def get_input_path(self, name):
+        return self._inputs.get(name)
+
+
+def manifest_defaults():
+    with open(repo_dir / 'manifest.json') as manifest_file:
+        manifest = json.load(manifest_file)
+    return {k: v.get('default') for k, v in manifest['config'].items()}
+
+
+def install_fakes():
+    # run.py imports the SDK and toolkit at module level, use the fakes where they
+    # aren't installed.  The client itself is always the fake.
+    try:
+        import flywheel
+    except ImportError:
+        sys.modules['flywheel'] = sys.modules[__name__]
+    try:
+        import flywheel_gear_toolkit
+    except ImportError:
+        toolkit = types.ModuleType('flywheel_gear_toolkit')
+        toolkit.GearToolkitContext = FakeGearContext
+        sys.modules['flywheel_gear_toolkit'] = toolkit
+
+
+# Lets run.py be imported where the real SDK isn't installed
+Client = FakeClient
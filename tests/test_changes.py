@@ -0,0 +1,79 @@
+import copy
+import logging
+
+import pytest
+
+import fake_flywheel as ff
+from conftest import read_report
+from utils import import_data as id
+
+current = {'score': 1, 'visit': {'site': 'A', 'week': 4}, 'notes': None}
+cases = [
+    {'score': 1},
+    {'score': 2},
+    {'visit': {'site': 'B', 'arm': 'x'}},
+    {'visit': {}, 'new': {}},
+    {'notes': 'late', 'flag': True},
+    {'score': 1, 'visit': {'site': 'A', 'week': 4}, 'notes': None},
+]
+
+
+@pytest.mark.parametrize('overwrite', [True, False])
+@pytest.mark.parametrize('new', cases)
+def test_changes_are_what_update_changes(new, overwrite):
+    info = copy.deepcopy(current)
+    changes = id.get_changes(info, new, overwrite)
+    assert info == current
+    
+    updated = id.update(copy.deepcopy(current), new, overwrite)
+    assert id.update(copy.deepcopy(current), changes, overwrite) == updated
+    assert (changes == {}) == (updated == current)
+
+
+def test_changes_without_overwrite():
+    new = {'score': 2, 'visit': {'site': 'B', 'arm': 'x'}, 'flag': True}
+    
+    assert id.get_changes(current, new, False) == {'visit': {'arm': 'x'}, 'flag': True}
+    assert id.get_changes(current, new, True) == {'score': 2, 'visit': {'site': 'B', 'arm': 'x'},
+                                                  'flag': True}
+    assert id.update(copy.deepcopy(current), new, False) == {
+        'score': 1, 'visit': {'site': 'A', 'week': 4, 'arm': 'x'}, 'notes': None, 'flag': True}
+
+
+def test_overwrite(tmp_path, run_gear):
+    fw, analysis, labels = ff.build_fake(6, False, 0.0)
+    records = {r['label']: r for r in fw._store.values() if r['label'] in labels}
+    for label in labels[:3]:
+        records[label]['info']['imported'] = {'score': 0, 'kept': 'x'}
+    csv_path = tmp_path / 'scores.csv'
+    csv_path.write_text('label,score\n' + ''.join(f"{label},5\n" for label in labels))
+    
+    code, output_dir = run_gear(fw, analysis, csv_path, mapping_column='label', overwrite=False)
+    assert code == 0
+    assert [row['Gear_Status'] for row in read_report(output_dir)] == ['Unchanged'] * 3 + ['Success'] * 3
+    assert [records[label]['info']['imported'] for label in labels] == (
+        [{'score': 0, 'kept': 'x'}] * 3 + [{'score': 5}] * 3)
+    
+    code, output_dir = run_gear(fw, analysis, csv_path, mapping_column='label', overwrite=True)
+    assert code == 0
+    assert [row['Gear_Status'] for row in read_report(output_dir)] == ['Success'] * 3 + ['Unchanged'] * 3
+    assert [records[label]['info']['imported'] for label in labels] == (
+        [{'score': 5, 'kept': 'x'}] * 3 + [{'score': 5}] * 3)
+
+
+def test_verbose_log_reports_final_status(tmp_path, run_gear, caplog):
+    fw, analysis, labels = ff.build_fake(4, False, 0.0)
+    csv_path = tmp_path / 'scores.csv'
+    csv_path.write_text('label,score\n' + ''.join(f"{label},5\n" for label in labels))
+    
+    # The gear's init_logging replaces the root handlers, so listen on the gear's logger
+    logger = logging.getLogger('__main__')
+    logger.addHandler(caplog.handler)
+    try:
+        code, output_dir = run_gear(fw, analysis, csv_path, mapping_column='label', log_format='verbose')
+    finally:
+        logger.removeHandler(caplog.handler)
+    assert code == 0
+    assert 'STATUS: Queued' not in caplog.text
+    for label in labels:
+        assert f'STATUS: Success for {label}' in caplog.text
@@ -0,0 +1,41 @@
+import fake_flywheel as ff
+from conftest import read_report
+from utils import flywheel_helpers as fh
+
+
+def record(container_id, label):
+    return fh.ContainerRecord(container_id, 'acquisition', label)
+
+
+def test_index_keeps_every_match():
+    containers = [record('1', 'a'), record('2', 'b'), record('3', 'a'), record('4', None)]
+    index = fh.build_container_index(containers, 'label')
+    
+    assert [c.id for c in fh.find_in_index(index, 'a')] == ['1', '3']
+    assert [c.id for c in fh.find_in_index(index, 'b')] == ['2']
+    assert fh.find_in_index(index, 'c') == []
+
+
+def test_file_index():
+    parent = record('1', 'acq')
+    files = [fh.ContainerRecord(f"f{n}", 'file', name=name, parent=parent, file_id=f"f{n}")
+             for n, name in enumerate(['x.nii', 'y.nii', 'x.nii'])]
+    
+    by_name = fh.build_mapping_index(None, files, 'label', get_files=True)
+    by_id = fh.build_mapping_index(None, files, 'id', get_files=True)
+    assert [f.file_id for f in fh.find_in_index(by_name, 'x.nii')] == ['f0', 'f2']
+    assert [f.name for f in fh.find_in_index(by_id, 'f1')] == ['y.nii']
+
+
+def test_duplicate_labels_fail_their_rows(tmp_path, run_gear):
+    fw, analysis, labels = ff.build_fake(5, False, 0.0)
+    session = next(r for r in fw._store.values() if r['container_type'] == 'session')
+    fw.add_container('acquisition', labels[0], session)
+    csv_path = tmp_path / 'scores.csv'
+    csv_path.write_text('label,score\n' + ''.join(f"{label},1\n" for label in labels + ['nope']))
+    
+    code, output_dir = run_gear(fw, analysis, csv_path, mapping_column='label')
+    assert code == 0
+    assert [row['Gear_Status'] for row in read_report(output_dir)] == (
+        ['Failed'] + ['Success'] * (len(labels) - 1) + ['Failed'])
+    assert fw.api_client.calls['POST /acquisitions/{Id}/info'] == len(labels) - 1
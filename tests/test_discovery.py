@@ -0,0 +1,57 @@
+import pytest
+
+import fake_flywheel as ff
+from utils import discovery
+
+
+@pytest.fixture
+def fw():
+    fw = ff.FakeClient()
+    ff.build_project(fw, subjects=1, sessions=1, acquisitions=3)
+    return fw
+
+
+def acquisition_records(fw):
+    return list(discovery.iter_find_records(fw.acquisitions, ''))
+
+
+def test_hydrate_records(fw):
+    records = acquisition_records(fw)
+    
+    hydrated = discovery.hydrate_records(fw, 'acquisition', records)
+    assert sorted(hydrated) == sorted(r.id for r in records)
+    assert all(c.info == {} and c.files == [] for c in hydrated.values())
+
+
+def test_deleted_containers_are_left_out(fw):
+    records = acquisition_records(fw)
+    del fw._store[records[0].id]
+    
+    hydrated = discovery.hydrate_records(fw, 'acquisition', records)
+    assert sorted(hydrated) == sorted(r.id for r in records[1:])
+
+
+@pytest.mark.parametrize('status', [401, 500])
+def test_other_errors_stop_the_import(fw, monkeypatch, status):
+    records = acquisition_records(fw)
+    
+    def get_acquisition(container_id):
+        raise ff.ApiException(status, 'failed')
+    monkeypatch.setattr(fw, 'get_acquisition', get_acquisition)
+    
+    with pytest.raises(ff.ApiException):
+        discovery.hydrate_records(fw, 'acquisition', records)
+
+
+@pytest.mark.parametrize('limit, pages', [(1000, 1), (4, 4)])
+def test_auto_lookup_limit(tmp_path, run_gear, limit, pages):
+    fw, analysis, labels = ff.build_fake(5, False, 0.0, project_size=1000)
+    csv_path = tmp_path / 'scores.csv'
+    csv_path.write_text('label,score\n' + ''.join(f"{label},1\n" for label in labels))
+    
+    code, output_dir = run_gear(fw, analysis, csv_path, mapping_column='label',
+                                auto_lookup_limit=limit)
+    assert code == 0
+    # Targeted searches ask for the five names at once, a full listing pages through
+    # the project's 1000 acquisitions
+    assert fw.api_client.calls['GET /acquisitions'] == pages
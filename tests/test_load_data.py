@@ -0,0 +1,37 @@
+import openpyxl
+import pytest
+
+from utils import load_data as ld
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = tmp_path / 'tracker.xlsx'
+    book = openpyxl.Workbook()
+    book.active.title = 'first'
+    book.active.append(['label', 'score'])
+    book.active.append(['a', 1])
+    second = book.create_sheet('second')
+    second.append(['label', 'score'])
+    second.append(['b', 2])
+    book.save(path)
+    return path
+
+
+@pytest.mark.parametrize('sheets_spec, expected', [
+    (None, ['first']), ('', ['first']), (0, ['first']), (1, ['second']), (-1, ['second']),
+    ('second', ['second']), (' first , second ', ['first', 'second']), ('*', ['first', 'second']),
+])
+def test_sheet_names(workbook, sheets_spec, expected):
+    assert ld.get_sheet_names(workbook, sheets_spec) == expected
+
+
+@pytest.mark.parametrize('sheets_spec', [2, 'third'])
+def test_missing_sheet(workbook, sheets_spec):
+    with pytest.raises(Exception, match='Sheet not in Excel file'):
+        ld.get_sheet_names(workbook, sheets_spec)
+
+
+def test_sheet_by_position(workbook):
+    assert ld.load_excel_dataframe(workbook, 1).to_dict('records') == [{'label': 'a', 'score': 1}]
+    assert ld.load_excel_dataframe(workbook, 1, 1).to_dict('records') == [{'label': 'b', 'score': 2}]
@@ -0,0 +1,34 @@
+import csv
+
+import fake_flywheel as ff
+from utils import preflight as pf
+
+
+def write_keys(path, labels):
+    path.write_text('label,score\n' + ''.join(f"{label},{n}\n" for n, label in enumerate(labels)))
+
+
+def test_min_match_rate_stops_before_writing(tmp_path, run_gear, reader):
+    fw, analysis, labels = ff.build_fake(6, False, 0.0)
+    csv_path = tmp_path / 'scores.csv'
+    write_keys(csv_path, labels + ['nope-1', 'nope-2', 'nope-3'])
+    
+    code, output_dir = run_gear(fw, analysis, csv_path, mapping_column='label', min_match_rate=80,
+                                **reader)
+    assert code == 1
+    assert fw.api_client.calls['POST /acquisitions/{Id}/info'] == 0
+    with open(output_dir / pf.report_name) as report_file:
+        rows = list(csv.DictReader(report_file))
+    assert [(row['key'], row['problem']) for row in rows] == [
+        ('nope-1', 'no match'), ('nope-2', 'no match'), ('nope-3', 'no match')]
+
+
+def test_min_match_rate_met(tmp_path, run_gear):
+    fw, analysis, labels = ff.build_fake(6, False, 0.0)
+    csv_path = tmp_path / 'scores.csv'
+    write_keys(csv_path, labels + ['nope-1', 'nope-2', 'nope-3'])
+    
+    code, output_dir = run_gear(fw, analysis, csv_path, mapping_column='label', min_match_rate=60)
+    assert code == 0
+    assert fw.api_client.calls['POST /acquisitions/{Id}/info'] == len(labels)
+    assert (output_dir / pf.report_name).exists()
@@ -0,0 +1,145 @@
+import types
+
+import pytest
+
+from fake_flywheel import ApiException
+from utils import rate_control as rc
+
+endpoint = 'GET /acquisitions/{Id}'
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Delays the governor asked for, without waiting for them
+    delays = []
+    monkeypatch.setattr(rc.time, 'sleep', delays.append)
+    return delays
+
+
+def failing(*errors, result='ok'):
+    # A request raising each error in turn, then returning result
+    calls = []
+    
+    def request():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    
+    request.calls = calls
+    return request
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_throttled_requests_are_retried(sleeps, status):
+    governor = rc.RateGovernor(8)
+    request = failing(ApiException(status), ApiException(status))
+    
+    assert governor.call(endpoint, request) == 'ok'
+    assert len(request.calls) == 3
+    assert (governor.retried, governor.throttled) == (2, 2)
+    assert len(sleeps) == 2
+
+
+@pytest.mark.parametrize('error', [ApiException(500), ApiException(502), ConnectionResetError()])
+def test_transient_errors_are_retried(sleeps, error):
+    governor = rc.RateGovernor(8)
+    request = failing(error)
+    
+    assert governor.call(endpoint, request) == 'ok'
+    assert (governor.retried, governor.throttled) == (1, 0)
+    assert 0 <= sleeps[0] <= rc.backoff
+
+
+@pytest.mark.parametrize('error', [ApiException(404), ApiException(401), KeyError('bug')])
+def test_other_errors_propagate(sleeps, error):
+    governor = rc.RateGovernor(8)
+    request = failing(error)
+    
+    with pytest.raises(type(error)):
+        governor.call(endpoint, request)
+    assert len(request.calls) == 1
+    assert governor.retried == 0
+    assert sleeps == []
+
+
+def test_retries_run_out(sleeps):
+    governor = rc.RateGovernor(8, retries=2)
+    request = failing(*[ApiException(500)] * 5)
+    
+    with pytest.raises(ApiException):
+        governor.call(endpoint, request)
+    assert len(request.calls) == 3
+    assert governor.in_flight == 0
+
+
+def test_retry_after_pauses_every_request():
+    governor = rc.RateGovernor(8)
+    
+    delay = governor._on_error(ApiException(429, headers={'Retry-After': '2'}), 0)
+    assert delay >= 2
+    assert governor.paused_until > rc.time.monotonic() + 1.5
+
+
+def test_limit_grows_shrinks_and_recovers():
+    governor = rc.RateGovernor(8)
+    # Slow start, one more request at a time per success that filled the limit
+    for _ in range(3):
+        governor._on_success(endpoint, 0.01)
+    assert governor.limit == 4
+    for _ in range(10):
+        governor._on_success(endpoint, 0.01)
+    assert governor.limit == 8
+    
+    # Throttling cuts the limit once per round trip
+    governor._on_error(ApiException(429), 0)
+    governor._on_error(ApiException(429), 0)
+    assert governor.limit == pytest.approx(8 * rc.decrease_factor)
+    assert (governor.decreases, governor.ceiling) == (1, 8)
+    
+    # Then it grows by about one per round trip (limit successes), slower near the
+    # limit that was throttled, and never past max_concurrency
+    limit = governor.limit
+    for _ in range(6):
+        governor._on_success(endpoint, 0.01)
+    assert limit + 0.9 < governor.limit < limit + 1.1
+    for _ in range(500):
+        governor._on_success(endpoint, 0.01)
+    assert governor.limit == 8
+    
+    # Successes that didn't fill the limit say nothing about more requests
+    governor._last_decrease -= 60
+    governor._on_error(ApiException(503), 0)
+    limit = governor.limit
+    governor._on_success(endpoint, 0.01, full=False)
+    assert governor.limit == limit
+
+
+def test_latency_climb_cuts_the_limit():
+    governor = rc.RateGovernor(8)
+    for _ in range(7):
+        governor._on_success(endpoint, 0.01)
+    assert governor.limit == 8
+    
+    for _ in range(10):
+        governor._on_success(endpoint, 1.0)
+    assert governor.limit < 8
+    assert governor.decreases >= 1
+    assert governor.lowest_limit < 8
+
+
+def test_govern_client_wraps_every_request(sleeps):
+    calls = []
+    
+    def call_api(resource_path, method, *args, **kwargs):
+        calls.append((method, resource_path))
+        if len(calls) == 1:
+            raise ApiException(429)
+        return 'response'
+    
+    fw = types.SimpleNamespace(api_client=types.SimpleNamespace(call_api=call_api))
+    governor = rc.govern_client(fw, 4)
+    
+    assert fw.api_client.call_api('/projects/{Id}', 'GET') == 'response'
+    assert calls == [('GET', '/projects/{Id}')] * 2
+    assert governor.throttled == 1
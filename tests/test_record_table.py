@@ -0,0 +1,93 @@
+import math
+
+import pytest
+
+from utils import import_data as id, load_data as ld, record_table as rt
+
+# Layouts the csv module path has to read the way pandas does.  'None' is left out,
+# pandas only counts it as missing from 2.0 on.
+tables = {
+    'types': 'a,b,c,d,e,f,g,h,i,,a,j,k\n'
+             '1,1.5,x,True,1, 5,05,1e3,NA,z,q,99999999999999999999,.5\n'
+             '2,,y,false,,6 ,+7,inf,n/a,z,r,1,5.\n'
+             '3,2,5,TRUE,3,7,8,-inf,,z,s,2,-0.0\n',
+    'quoted': 'a,b\n"x,1",2\n"multi\nline",3\n\n',
+    'short rows': 'h1,h2,h3\n1,2\n3,4,5\n',
+    'leading zeros': 'id,v\n001,1.50\n002,2.0\n',
+    'empty cells': 'id,v,w\na,True,\nb,,\n',
+    'byte order mark': '﻿id,v\na,1\n',
+    'header only': 'id,v\n',
+    'large numbers': 'id,v\na,1e400\nb,-1.5E-3\nc,12345678901234567890123\n',
+    'spaces': 'id,v\na, x \nb,"  5"\n',
+    'repeated headers': 'a,a.1,a,a,b,b.1,b.1,b,,\n1,2,3,4,5,6,7,8,9,10\n',
+}
+
+
+def same(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b and type(a) == type(b)
+
+
+def check_parity(path, column_types=None):
+    df = ld.load_text_dataframe(path, 1, ',', column_types)
+    table = rt.read_small_csv(path, 1, ',', 1000, column_types)
+    assert table is not None
+    assert table.columns == list(df.columns)
+    
+    expected = list(id.prepare_records(df))
+    rows = list(table.records())
+    assert len(rows) == len(expected)
+    for row, expected_row in zip(rows, expected):
+        assert list(row) == list(expected_row)
+        assert all(same(row[k], expected_row[k]) for k in expected_row), (row, expected_row)
+
+
+@pytest.mark.parametrize('name', sorted(tables))
+def test_records_match_pandas(tmp_path, name):
+    path = tmp_path / 'table.csv'
+    path.write_text(tables[name], encoding='utf-8')
+    check_parity(path)
+
+
+@pytest.mark.parametrize('name', ['leading zeros', 'large numbers', 'byte order mark', 'header only'])
+def test_typed_records_match_pandas(tmp_path, name):
+    path = tmp_path / 'table.csv'
+    path.write_text(tables[name], encoding='utf-8')
+    check_parity(path, {'id': 'str', 'v': 'float'})
+
+
+def test_values_that_dont_fit_their_type_fail_both_ways(tmp_path):
+    path = tmp_path / 'table.csv'
+    path.write_text(tables['spaces'])
+    
+    with pytest.raises(ValueError):
+        ld.load_text_dataframe(path, 1, ',', {'v': 'float'})
+    with pytest.raises(ValueError):
+        rt.read_small_csv(path, 1, ',', 1000, {'v': 'float'})
+
+
+def test_report_matches_pandas(tmp_path):
+    path = tmp_path / 'table.csv'
+    path.write_text(tables['types'])
+    ld.load_text_dataframe(path, 1, ',').to_csv(tmp_path / 'pandas.csv', index=False)
+    rt.read_small_csv(path, 1, ',', 1000).to_csv(tmp_path / 'records.csv', index=False)
+    
+    assert (tmp_path / 'records.csv').read_text() == (tmp_path / 'pandas.csv').read_text()
+
+
+def test_rows_longer_than_header_are_left_to_pandas(tmp_path):
+    path = tmp_path / 'table.csv'
+    path.write_text('h1,h2\n1,2,3\n')
+    
+    assert rt.read_small_csv(path, 1, ',', 1000) is None
+
+
+def test_repeated_headers_stay_unique(tmp_path):
+    path = tmp_path / 'table.csv'
+    path.write_text(tables['repeated headers'])
+    
+    table = rt.read_small_csv(path, 1, ',', 1000)
+    assert table.columns == ['a', 'a.1', 'a.2', 'a.3', 'b', 'b.1', 'b.1.1', 'b.2',
+                             'Unnamed: 8', 'Unnamed: 9']
+    assert list(table.records()) == [dict(zip(table.columns, range(1, 11)))]
@@ -0,0 +1,29 @@
+
+import fake_flywheel as ff
+from conftest import read_report
+
+missing = ['benchmark/benchmark/sub-00000/nope/zz', 'benchmark/benchmark/sub-00000/nope/yy']
+
+
+def test_path_report_imports_again(tmp_path, run_gear, reader):
+    fw, analysis, paths = ff.build_fake(20, False, 0.0, mapping_type='path')
+    csv_path = tmp_path / 'tracker.csv'
+    with open(csv_path, 'w') as csv_file:
+        csv_file.write('Gear_FW_Location,score\n')
+        for n, path in enumerate(paths + missing):
+            csv_file.write(f"{path},{n}\n")
+    
+    settings = dict(mapping_type='path', mapping_column='Gear_FW_Location', **reader)
+    code, output_dir = run_gear(fw, analysis, csv_path, **settings)
+    assert code == 0
+    report = read_report(output_dir)
+    assert [row['Gear_FW_Location'] for row in report] == paths + missing
+    assert [row['Gear_FW_Location'] for row in report if row['Gear_Status'] == 'Failed'] == missing
+    
+    # The report, failed rows included, is a valid input
+    code, output_dir = run_gear(fw, analysis, output_dir / 'Data_Import_Status_report.csv',
+                                **settings)
+    assert code == 0
+    again = read_report(output_dir)
+    assert [row['Gear_FW_Location'] for row in again] == paths + missing
+    assert [row['Gear_Status'] for row in again] == ['Unchanged'] * len(paths) + ['Failed'] * 2
@@ -0,0 +1,54 @@
+import json
+
+import fake_flywheel as ff
+from conftest import read_report
+from utils import journal as jn, preflight as pf
+
+
+def test_resume_from_partial_journal(tmp_path, run_gear, reader):
+    csv_path = tmp_path / 'scores.csv'
+    fw, analysis, labels = ff.build_fake(12, False, 0.0)
+    csv_path.write_text('label,score\n' + ''.join(f"{label},{n}\n" for n, label in enumerate(labels)))
+    code, output_dir = run_gear(fw, analysis, csv_path, mapping_column='label', **reader)
+    assert code == 0
+    
+    # A job killed partway: five rows committed and the sixth line cut off
+    lines = (output_dir / jn.journal_name).read_text().splitlines()
+    assert len(lines) == len(labels)
+    partial_journal = tmp_path / 'partial.jsonl'
+    partial_journal.write_text('\n'.join(lines[:5]) + '\n' + lines[5][:20])
+    done = {json.loads(line)['key'] for line in lines[:5]}
+    
+    # The same project again, nothing imported yet
+    fw, analysis, labels = ff.build_fake(12, False, 0.0)
+    code, output_dir = run_gear(fw, analysis, csv_path, partial_journal, mapping_column='label',
+                                resume=True, **reader)
+    assert code == 0
+    assert fw.api_client.calls['POST /acquisitions/{Id}/info'] == len(labels) - 5
+    imported = {r['label'] for r in fw._store.values() if r['info'].get('imported')}
+    assert imported == set(labels) - done
+    assert {row['Gear_Status'] for row in read_report(output_dir)} == {'Success'}
+    
+    # The new journal covers every row, so it can be resumed from again
+    entries = jn.load_journal(output_dir / jn.journal_name, 'imported')
+    assert set(entries) == set(labels)
+
+
+def test_resume_only_looks_up_rows_left(tmp_path, run_gear, reader):
+    fw, analysis, labels = ff.build_fake(12, False, 0.0, project_size=1000)
+    # The previous job committed five rows, one of them to a container deleted since
+    journal_path = tmp_path / 'previous.jsonl'
+    journal = jn.ImportJournal(journal_path, 'imported')
+    for key in labels[:5] + ['deleted']:
+        journal.record(key, 'Success')
+    journal.close()
+    csv_path = tmp_path / 'scores.csv'
+    csv_path.write_text('label,score\n' + ''.join(f"{label},1\n" for label in labels + ['deleted']))
+    
+    code, output_dir = run_gear(fw, analysis, csv_path, journal_path, mapping_column='label',
+                                resume=True, auto_lookup_limit=7, **reader)
+    assert code == 0
+    # Seven names left is under the limit, one search instead of paging through the project
+    assert fw.api_client.calls['GET /acquisitions'] == 1
+    assert not (output_dir / pf.report_name).exists()
+    assert {row['Gear_Status'] for row in read_report(output_dir)} == {'Success'}
@@ -0,0 +1,59 @@
+import pytest
+
+import fake_flywheel as ff
+from utils import discovery, snapshot as sn
+
+
+@pytest.fixture
+def project(tmp_path):
+    fw = ff.FakeClient()
+    record, _ = ff.build_project(fw, subjects=2, sessions=2, acquisitions=2, files=2)
+    return fw, fw.get_project(record['id'])
+
+
+def file_names(fw, project, snapshot):
+    files = discovery.discover_from_snapshot(fw, project, 'acquisition', snapshot, get_files=True)
+    return sorted(f.name for f in files)
+
+
+def all_file_names(fw):
+    return sorted(f['name'] for r in fw._store.values() for f in r['files'])
+
+
+def test_later_runs_only_fetch_changed_containers(tmp_path, project):
+    fw, project = project
+    snapshot = sn.HierarchySnapshot(tmp_path / sn.snapshot_name)
+    assert file_names(fw, project, snapshot) == all_file_names(fw)
+    
+    acquisition = next(r for r in fw._store.values() if r['container_type'] == 'acquisition')
+    fw.add_file(acquisition, 'new.nii.gz')
+    fw.api_client.calls.clear()
+    assert file_names(fw, project, snapshot) == all_file_names(fw)
+    assert fw.api_client.calls['GET /acquisitions/{Id}'] == 1
+
+
+def test_file_lists_not_stored_are_fetched_again(tmp_path, project, monkeypatch):
+    fw, project = project
+    path = tmp_path / sn.snapshot_name
+    
+    # The run stops after the refresh, before the changed containers are fetched
+    def stop(*args):
+        raise KeyboardInterrupt
+    with monkeypatch.context() as patch:
+        patch.setattr(discovery, 'hydrate_records', stop)
+        with pytest.raises(KeyboardInterrupt):
+            file_names(fw, project, sn.HierarchySnapshot(path))
+    
+    snapshot = sn.HierarchySnapshot(path)
+    assert file_names(fw, project, snapshot) == all_file_names(fw)
+    fw.api_client.calls.clear()
+    assert file_names(fw, project, snapshot) == all_file_names(fw)
+    assert fw.api_client.calls['GET /acquisitions/{Id}'] == 0
+
+
+def test_listing_without_files_leaves_file_lists_stale(tmp_path, project):
+    fw, project = project
+    snapshot = sn.HierarchySnapshot(tmp_path / sn.snapshot_name)
+    discovery.discover_from_snapshot(fw, project, 'acquisition', snapshot)
+    
+    assert file_names(fw, project, snapshot) == all_file_names(fw)
@@ -0,0 +1,32 @@
+import zipfile
+
+import fake_flywheel as ff
+from conftest import read_report
+
+
+def write_zip(path, members, labels):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for member in members:
+            archive.writestr(member, 'label,score\n' + ''.join(f"{label},1\n" for label in labels))
+
+
+def test_same_file_name_in_two_folders_fails(tmp_path, run_gear):
+    fw, analysis, labels = ff.build_fake(10, False, 0.0)
+    zip_path = tmp_path / 'tables.zip'
+    write_zip(zip_path, ['a/sub1.csv', 'b/sub1.csv'], labels)
+    
+    code, output_dir = run_gear(fw, analysis, zip_path, mapping_column='label')
+    assert code == 1
+    assert fw.api_client.calls['POST /acquisitions/{Id}/info'] == 0
+
+
+def test_tables_in_folders_get_their_own_destination(tmp_path, run_gear):
+    fw, analysis, labels = ff.build_fake(10, False, 0.0)
+    zip_path = tmp_path / 'tables.zip'
+    write_zip(zip_path, ['a/sub1.csv', 'b/sub2.csv'], labels)
+    
+    code, output_dir = run_gear(fw, analysis, zip_path, mapping_column='label')
+    assert code == 0
+    assert {row['Gear_Status'] for row in read_report(output_dir)} == {'Success'}
+    record = next(r for r in fw._store.values() if r['label'] == labels[0])
+    assert record['info']['imported'] == {'sub1': {'score': 1}, 'sub2': {'score': 1}}
@@ -0,0 +1,173 @@
+import collections
+import collections.abc
+import logging
+
+from utils import flywheel_helpers as fh, import_data as id, discovery, row_logging as rl
+from utils.metadata_writer import MetadataWriter
+
+log = logging.getLogger("__main__")
+
+# One table of a batch import, rows are matched on mapping_column and their
+# metadata goes under destination
+Table = collections.namedtuple('Table', ['name', 'df', 'mapping_column', 'destination'])
+
+
+def merge_metadata(d, u):
+    # Nested merge of u into d, values from u win
+    for k, v in u.items():
+        if isinstance(v, collections.abc.Mapping) and isinstance(d.get(k), collections.abc.Mapping):
+            merge_metadata(d[k], v)
+        else:
+            d[k] = v
+    return d
+
+
+class TableState:
+    # Rows and per-row results of one table
+    def __init__(self, table):
+        self.table = table
+        self.records = id.prepare_records(
+            table.df, [c for c in id.status_columns if c != table.mapping_column])
+        self.keys = self.records.column(table.mapping_column)
+        self.row_labels = list(table.df.index)
+        self.statuses = ['Failed'] * len(self.records)
+        self.locations = [None] * len(self.records)
+
+    def key(self, position):
+        return self.keys[position]
+
+
+def import_batch(fw,
+                 tables,
+                 container_index,
+                 overwrite=False,
+                 dry_run=False,
+                 max_workers=1,
+                 journal=None,
+                 completed=None,
+                 log_format='verbose'):
+
+    # Matches the rows of every table first, then sends one update_info per container
+    # with the metadata of all the rows (from any table) that point at it.
+    # completed is {table name: {key: journal entry}} from a previous run.
+    # Returns the tables' frames with their status columns filled in.
+    compact = log_format == 'compact'
+    states = [TableState(table) for table in tables]
+    progress = rl.ImportProgress(sum(len(s.records) for s in states)) if compact else None
+    completed = completed or {}
+
+    def record(state, position, status, container=None, reason=None):
+        state.statuses[position] = status
+        if journal is not None:
+            journal.record(state.key(position),
+                           status,
+                           fh.get_id(container) if container is not None else None,
+                           state.locations[position],
+                           state.row_labels[position],
+                           state.table.name)
+        if compact:
+            rl.log_row(f"{state.table.name}:{state.row_labels[position]}", state.key(position),
+                       status, state.locations[position], reason)
+            progress.update(status)
+        elif reason is not None:
+            log.warning(f"{state.table.name} row {state.row_labels[position]} "
+                        f"'{state.key(position)}': {status}, {reason}")
+
+    # container id -> [container, merged metadata, [(state, position)]]
+    pending = collections.OrderedDict()
+    for state in states:
+        log.info(f"Matching {len(state.records)} rows of {state.table.name} "
+                 f"to info.{state.table.destination}")
+        table_completed = completed.get(state.table.name) or {}
+
+        hydrated = {}
+        for position, upload_obj in enumerate(state.records):
+            if position % id.hydrate_window == 0:
+                window = state.keys[position:position + id.hydrate_window]
+                hydrated = discovery.hydrate_keys(
+                    fw,
+                    {key for key in window if str(key) not in table_completed},
+                    container_index)
+
+            try:
+                object_name = upload_obj.get(state.table.mapping_column)
+
+                previous = table_completed.get(str(object_name))
+                if previous is not None:
+                    state.statuses[position] = previous['status']
+                    state.locations[position] = previous.get('location')
+                    if compact:
+                        progress.update(previous['status'])
+                    continue
+
+                matches = fh.find_in_index(container_index, object_name)
+                if len(matches) != 1:
+                    record(state, position, 'Failed',
+                           reason=f"{len(matches)} objects match" if matches else 'no match')
+                    continue
+
+                match = hydrated.get(fh.get_id(matches[0])) or fh.hydrate(fw, matches[0])
+                state.locations[position] = fh.generate_path_to_container(fw, match)
+
+                data = dict(upload_obj)
+                data.pop(state.table.mapping_column)
+                data = id.nest_metadata(data, state.table.destination)
+
+                entry = pending.setdefault(fh.get_id(match), [match, {}, []])
+                merge_metadata(entry[1], data)
+                entry[2].append((state, position))
+
+            except Exception as e:
+                log.debug(f"{state.table.name} row {state.row_labels[position]} failed",
+                          exc_info=True)
+                record(state, position, 'Failed', reason=e)
+
+    log.info(f"Updating {len(pending)} objects")
+    writer = MetadataWriter(max_workers)
+    for match, data, rows in pending.values():
+        try:
+            if dry_run:
+                for state, position in rows:
+                    record(state, position, 'Dry-Run Success', match)
+                continue
+
+            current_info = match.info
+            changes = id.get_changes(current_info, data, overwrite)
+            if not changes:
+                for state, position in rows:
+                    record(state, position, 'Unchanged', match)
+                continue
+
+            update_data = id.update(current_info, changes, overwrite)
+            update_data = {k: update_data[k] for k in changes}
+
+            def on_done(error, match=match, rows=rows):
+                for state, position in rows:
+                    record(state, position, 'Success' if error is None else 'Failed', match, error)
+
+            writer.submit(fh.get_id(match), match, update_data, on_done)
+
+        except Exception as e:
+            log.debug(f"update of {fh.get_id(match)} failed", exc_info=True)
+            for state, position in rows:
+                record(state, position, 'Failed', match, e)
+
+    try:
+        # Statuses are set by the callbacks, this only waits for the writes
+        for _ in writer.results():
+            pass
+    finally:
+        writer.shutdown()
+
+    if compact:
+        progress.finish()
+
+    frames = []
+    for state in states:
+        df = id.add_sheet_column(state.table.df, state.table.name)
+        df['Gear_Status'] = state.statuses
+        df['Gear_FW_Location'] = id.report_locations(state.keys, state.locations,
+                                                     state.table.mapping_column)
+        frames.append(df)
+
+    return frames
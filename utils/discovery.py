@@ -0,0 +1,436 @@
+import collections
+import concurrent.futures
+import logging
+
+from utils import flywheel_helpers as fh
+
+log = logging.getLogger("__main__")
+
+container_levels = ['project', 'subject', 'session', 'acquisition']
+
+# Targeted lookups query this many mapping keys at a time
+lookup_batch_size = 100
+# In 'auto' mode, CSVs with more unique keys than this list the whole level instead.
+# A project's size isn't known before it is listed, run.main sets the
+# auto_lookup_limit config here.
+targeted_key_limit = 1000
+# Keys containing these can't be written into a search filter
+unsafe_filter_characters = set(',[]|')
+# Full containers are fetched by id this many at a time, the requests still go through
+# the client's rate governor
+hydrate_workers = 8
+
+# Search field for the mapping keys of containers and of files, by mapping_type
+lookup_fields = {
+    'label': ('label', 'files.name'),
+    'id': ('_id', 'files.file_id'),
+}
+# The file entry attribute holding the mapping key
+file_keys = {
+    'label': 'name',
+    'id': 'file_id',
+}
+
+# Ancestors generate_path_to_container looks up by id for a container at each level.
+# Sessions embed their subject, so they only need the project.
+path_ancestors = {
+    'project': [],
+    'subject': ['project'],
+    'session': ['project'],
+    'acquisition': ['project', 'subject', 'session'],
+}
+
+
+def iter_find_records(finder, query):
+    # Finder results leave out info and files, they are only ever kept as records and
+    # fetched in full by hydrate_records when a row needs them
+    return (fh.to_record(c) for c in finder.iter_find(query))
+
+
+def iter_level(fw, project, level):
+    # One paged find over the whole project instead of walking down the tree
+    # one container at a time.
+    finder = getattr(fw, f"{level}s")
+    return iter_find_records(finder, f"parents.project={project.id}")
+
+
+def find_level(fw, project, level):
+    # Records for every container at the level
+    if level == 'project':
+        return [project]
+
+    containers = list(iter_level(fw, project, level))
+    log.debug(f"found {len(containers)} {level} containers on project {project.label}")
+
+    return containers
+
+
+def prime_hierarchy(containers):
+    for container in containers:
+        fh.hierarchy_cache.put(container.id, container)
+
+
+def discover_containers(fw, project, level, get_files=False, keys=None):
+
+    # Lists the whole level as records, import_data fetches the matched ones in full.
+    # Finds don't return files, so for files every container is fetched by id (one
+    # request per container, the searches only save the walk down the tree), and
+    # only files whose name is one of the mapping keys (and their parents) are kept
+    # in full.  The rest are only needed to spot ambiguous names and build paths.
+    if level not in container_levels:
+        raise Exception(f"Unsupported container level {level}")
+
+    key_set = {str(k) for k in keys} if keys is not None else None
+
+    def wanted(key):
+        return key_set is None or str(key) in key_set
+
+    fh.hierarchy_cache.put(project.id, project)
+    for ancestor_level in path_ancestors[level]:
+        if ancestor_level != 'project':
+            prime_hierarchy(find_level(fw, project, ancestor_level))
+
+    if level == 'project':
+        return ([f if wanted(f.name) else fh.file_record(f, project) for f in project.files]
+                if get_files else [project])
+
+    if not get_files:
+        return find_level(fw, project, level)
+
+    # File parents are the containers we just fetched, so path generation for a
+    # file never has to reload its parent.
+    records = find_level(fw, project, level)
+    containers = []
+    files = []
+    for start in range(0, len(records), lookup_batch_size):
+        batch = records[start:start + lookup_batch_size]
+        hydrated = hydrate_records(fw, level, batch)
+        for record in batch:
+            container = hydrated.get(record.id)
+            if container is None:
+                containers.append(record)
+                continue
+            parent = container if any(wanted(f.name) for f in container.files) else record
+            containers.append(parent)
+            files.extend(f if wanted(f.name) else fh.file_record(f, parent) for f in container.files)
+    prime_hierarchy(containers)
+    log.debug(f"found {len(files)} files on {len(containers)} {level} containers")
+
+    return files
+
+
+def use_targeted_lookup(keys, lookup_mode):
+
+    if lookup_mode == 'full' or keys is None:
+        return False
+
+    if any(unsafe_filter_characters.intersection(str(k)) for k in keys):
+        log.info("Some object names can't be used in a search filter, "
+                 "listing every container instead")
+        return False
+
+    if lookup_mode == 'targeted':
+        return True
+
+    return len(keys) <= targeted_key_limit
+
+
+def prime_ancestors(fw, level, containers):
+    
+    # Find the ancestors path generation needs for these containers in batches by id,
+    # instead of one request per container the first time each one is seen.  Paths
+    # only need their labels, records are enough.
+    for ancestor_level in path_ancestors[level]:
+        if ancestor_level == 'project':
+            continue
+        ids = {getattr(c.parents, ancestor_level, None) for c in containers}
+        missing = [i for i in sorted(ids - {None}) if i not in fh.hierarchy_cache]
+        if missing:
+            prime_hierarchy(find_by_ids(fw, ancestor_level, missing))
+
+
+def find_by_ids(fw, level, ids):
+    # Records for the containers at one level with these ids, in batched searches
+    finder = getattr(fw, f"{level}s")
+    records = []
+    for start in range(0, len(ids), lookup_batch_size):
+        query = f"_id=|[{','.join(ids[start:start + lookup_batch_size])}]"
+        records.extend(iter_find_records(finder, query))
+
+    return records
+
+
+def iter_by_keys(fw, project, level, keys, get_files=False, mapping_type='label'):
+    
+    # Yields (batch of keys, containers or files) for each batch of mapping keys.
+    # Every container with one of the batch's labels (or file names, or ids) is in the
+    # same search, so a batch's matches are complete as soon as it is yielded.
+    fh.hierarchy_cache.put(project.id, project)
+    keys = sorted({str(k) for k in keys if k is not None})
+    finder = getattr(fw, f"{level}s")
+    field = lookup_fields[mapping_type][get_files]
+    file_key = file_keys[mapping_type]
+    
+    for start in range(0, len(keys), lookup_batch_size):
+        batch = keys[start:start + lookup_batch_size]
+        query = f"parents.project={project.id},{field}=|[{','.join(batch)}]"
+        containers = list(iter_find_records(finder, query))
+        prime_ancestors(fw, level, containers)
+        
+        if not get_files:
+            yield batch, containers
+            continue
+        
+        # The files are only listed on the full containers
+        containers = list(hydrate_records(fw, level, containers).values())
+        prime_hierarchy(containers)
+        batch_set = set(batch)
+        yield batch, [f for c in containers for f in c.files if f.get(file_key) in batch_set]
+
+
+def find_by_keys(fw, project, level, keys, get_files=False, mapping_type='label'):
+
+    # Only fetch containers (or the containers holding files) whose label (or file
+    # name) is one of the mapping keys.  Every container sharing a label is still
+    # returned so ambiguous names are reported the same way as in full discovery.
+    if level == 'project':
+        return discover_containers(fw, project, level, get_files)
+    
+    found = {}
+    for batch, objects in iter_by_keys(fw, project, level, keys, get_files, mapping_type):
+        for obj in objects:
+            # A container can match several batches through its files
+            found[fh.get_id(obj)] = obj
+    found = list(found.values())
+    log.debug(f"found {len(found)} {level}{' files' if get_files else ' containers'} "
+              f"for {len(keys)} object names")
+    
+    return found
+
+
+def split_path(path):
+    # Segments of a group/project/subject/session/acquisition[/file] path
+    return str(path).split('/')
+
+
+def find_labels(fw, project, level, labels):
+    
+    # Every container at the level with one of the labels, in batched searches, or
+    # by listing the level when a label can't be searched for
+    labels = sorted(labels)
+    if any(unsafe_filter_characters.intersection(label) for label in labels):
+        label_set = set(labels)
+        return [c for c in iter_level(fw, project, level) if c.label in label_set]
+    
+    finder = getattr(fw, f"{level}s")
+    containers = []
+    for start in range(0, len(labels), lookup_batch_size):
+        batch = labels[start:start + lookup_batch_size]
+        containers.extend(iter_find_records(
+            finder, f"parents.project={project.id},label=|[{','.join(batch)}]"))
+    
+    return containers
+
+
+def find_by_paths(fw, project, level, paths, get_files=False):
+    
+    # Resolves full paths one level at a time.  Each level is a few batched label
+    # searches, and a container is kept only when its parent's path is a prefix of one
+    # of the CSV's paths, so labels repeated under different parents don't clash.
+    # Paths outside the destination project are left unmatched.
+    fh.hierarchy_cache.put(project.id, project)
+    project_path = f"{project.parents.group}/{project.label}"
+    depth = container_levels.index(level) + 2
+    
+    wanted = set()
+    outside = 0
+    for path in paths:
+        if path is None:
+            continue
+        segments = split_path(path)
+        if len(segments) != depth + (1 if get_files else 0):
+            continue
+        if '/'.join(segments[:2]) != project_path:
+            outside += 1
+            continue
+        wanted.update('/'.join(segments[:n]) for n in range(3, len(segments) + 1))
+    if outside:
+        log.warning(f"{outside} paths are not in project {project_path}, they will not match")
+    
+    # path -> containers with that path, labels repeated under one parent give
+    # several containers for a path and the row fails as ambiguous
+    resolved = {project_path: [project]}
+    for path_level in container_levels[1:depth - 1]:
+        parent_level = container_levels[container_levels.index(path_level) - 1]
+        parent_paths = {c.id: p for p, containers in resolved.items() for c in containers}
+        separators = container_levels.index(path_level) + 1
+        labels = {p.rsplit('/', 1)[-1] for p in wanted if p.count('/') == separators}
+        
+        resolved = {}
+        for container in find_labels(fw, project, path_level, labels):
+            parent_path = parent_paths.get(getattr(container.parents, parent_level, None))
+            path = f"{parent_path}/{container.label}"
+            if parent_path is not None and path in wanted:
+                resolved.setdefault(path, []).append(container)
+        prime_hierarchy(c for containers in resolved.values() for c in containers)
+        log.debug(f"resolved {len(resolved)} {path_level} paths")
+    
+    if not get_files:
+        return [c for containers in resolved.values() for c in containers]
+    
+    # The files are only listed on the full containers
+    hydrated = hydrate_records(fw, level, [c for containers in resolved.values() for c in containers
+                                           if isinstance(c, fh.ContainerRecord)])
+    prime_hierarchy(hydrated.values())
+    return [f for path, containers in resolved.items() for c in containers
+            for f in hydrated.get(c.id, c).get('files') or []
+            if f"{path}/{f.name}" in wanted]
+
+
+def hydrate_records(fw, level, records):
+    # Full objects for records at one level.  Finds leave out info and files, so each
+    # container is fetched by id, hydrate_workers at a time.  Transient errors were
+    # already retried by the rate governor, anything but a container deleted since it
+    # was listed stops the import.  Deleted ones are left out, their rows fail when
+    # they fetch it.
+    def fetch(record):
+        try:
+            return fh.get_level(fw, record.id, level)
+        except Exception as e:
+            if getattr(e, 'status', None) != 404:
+                raise
+            log.warning(f"{level} {record.id} no longer exists: {e}")
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=hydrate_workers) as executor:
+        return {c.id: c for c in executor.map(fetch, records) if c is not None}
+
+
+def hydrate_matches(fw, matches):
+
+    # {id: full object} for matched records, fetched by id in batches instead of one
+    # request per row.  SDK objects are used as they are, records that can't be
+    # found are left out and fetched (or fail) row by row.
+    matches = list(matches)
+    files = [m for m in matches if isinstance(m, fh.ContainerRecord) and m.container_type == 'file']
+    records = [m for m in matches if isinstance(m, fh.ContainerRecord) and m.container_type != 'file']
+    to_fetch = {r.id: r for r in records}
+    to_fetch.update({f.parent.id: f.parent for f in files
+                     if isinstance(f.parent, fh.ContainerRecord)})
+
+    by_level = collections.defaultdict(list)
+    for record in to_fetch.values():
+        by_level[record.container_type].append(record)
+
+    hydrated = {}
+    for level, level_records in by_level.items():
+        hydrated.update(hydrate_records(fw, level, level_records))
+    # File parents are needed again for their paths
+    prime_hierarchy(hydrated[f.parent.id] for f in files if f.parent.id in hydrated)
+
+    objects = {fh.get_id(m): m for m in matches if not isinstance(m, fh.ContainerRecord)}
+    objects.update({r.id: hydrated[r.id] for r in records if r.id in hydrated})
+    for record in files:
+        parent = hydrated.get(record.parent.id, record.parent)
+        if isinstance(parent, fh.ContainerRecord):
+            continue
+        for file_entry in parent.files:
+            if file_entry.name == record.name:
+                objects[record.file_id] = file_entry
+                break
+
+    return objects
+
+
+def hydrate_keys(fw, keys, container_index):
+    # hydrate_matches for the keys that match exactly one container, the others fail anyway
+    matches = {}
+    for key in keys:
+        found = fh.find_in_index(container_index, key)
+        if len(found) == 1:
+            matches[fh.get_id(found[0])] = found[0]
+    return hydrate_matches(fw, matches.values())
+
+
+def discover_from_snapshot(fw, project, level, snapshot, get_files=False, keys=None):
+
+    # Bring every level down to the requested one up to date, then build records for
+    # the level (or its files) and prime the hierarchy cache with their ancestors.
+    # Containers are records, import_data fetches the matched ones in full.  For files,
+    # containers whose file list is stale (changed since it was stored, by this run or
+    # one that stopped before storing it) are fetched to list their files, and so are
+    # the others holding a file a CSV row names.
+    fh.hierarchy_cache.put(project.id, project)
+    levels = container_levels[1:container_levels.index(level) + 1]
+    for snapshot_level in levels[:-1]:
+        snapshot.refresh(fw, project, snapshot_level)
+        prime_hierarchy(snapshot.load(project.id, snapshot_level))
+
+    snapshot.refresh(fw, project, level)
+    containers = snapshot.load(project.id, level)
+    if not get_files:
+        return containers
+
+    stale = snapshot.stale_files(containers)
+    fresh = hydrate_records(fw, level, [c for c in containers if c.id in stale])
+    snapshot.store_files(fresh.values())
+    records = [c for c in containers if c.id not in fresh]
+    prime_hierarchy(records)
+    files = snapshot.load_files(records)
+    if keys is not None:
+        key_set = {str(k) for k in keys if k is not None}
+        parent_ids = {f.parent.id for f in files if str(f.name) in key_set}
+        hydrated = hydrate_records(fw, level, [r for r in records if r.id in parent_ids])
+        files = [f for f in files if f.parent.id not in hydrated]
+        fresh.update(hydrated)
+
+    prime_hierarchy(fresh.values())
+    for container in fresh.values():
+        files.extend(container.files)
+
+    return files
+
+
+def iter_discover(fw, project, level, get_files=False, keys=None, lookup_mode='auto',
+                  snapshot=None, mapping_type='label'):
+    
+    # Yields (keys, objects) as discovery goes.  keys is the set of mapping keys whose
+    # matches are all in objects, or None once every key is resolved.  Only targeted
+    # lookups can resolve keys before the whole level has been listed.
+    if mapping_type == 'label':
+        targeted = snapshot is None and use_targeted_lookup(keys, lookup_mode)
+    else:
+        targeted = mapping_type == 'id'
+    
+    if targeted and level != 'project':
+        log.info(f"Looking up {len(keys)} object {'ids' if mapping_type == 'id' else 'names'} directly")
+        for batch, objects in iter_by_keys(fw, project, level, keys, get_files, mapping_type):
+            yield batch, objects
+        yield None, []
+        return
+    
+    yield None, discover(fw, project, level, get_files, keys, lookup_mode, snapshot, mapping_type)
+
+
+def discover(fw, project, level, get_files=False, keys=None, lookup_mode='auto', snapshot=None,
+             mapping_type='label'):
+    
+    # Ids and paths are always looked up directly, without listing the project
+    if level != 'project' and mapping_type == 'id':
+        log.info(f"Looking up {len(keys)} object ids directly")
+        return find_by_keys(fw, project, level, keys, get_files, mapping_type)
+    
+    if mapping_type == 'path':
+        log.info(f"Resolving {len(keys)} paths")
+        return find_by_paths(fw, project, level, keys, get_files)
+    
+    if snapshot is not None and level != 'project':
+        log.info(f"Using hierarchy snapshot {snapshot.path}")
+        return discover_from_snapshot(fw, project, level, snapshot, get_files, keys)
+
+    if use_targeted_lookup(keys, lookup_mode):
+        log.info(f"Looking up {len(keys)} object names directly")
+        return find_by_keys(fw, project, level, keys, get_files)
+
+    log.info(f"Listing every {level}{' file' if get_files else ''} in project {project.label}")
+    return discover_containers(fw, project, level, get_files, keys)
@@ -1,7 +1,180 @@
+import collections
 import logging
+import sys
+import threading
 
 log = logging.getLogger()
 
+
+class HierarchyCache:
+    # Per-run cache of ancestor containers keyed by container id.  Bounded caches
+    # evict the least recently used entry once max_size is reached.
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._containers = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._containers)
+    
+    def __contains__(self, container_id):
+        return container_id in self._containers
+    
+    def get(self, container_id, loader):
+        with self._lock:
+            if container_id in self._containers:
+                self._containers.move_to_end(container_id)
+                self.hits += 1
+                return self._containers[container_id]
+            self.misses += 1
+        
+        container = loader()
+        self.put(container_id, container)
+        return container
+    
+    def put(self, container_id, container):
+        if container_id is None or container is None:
+            return
+        with self._lock:
+            self._containers[container_id] = container
+            self._containers.move_to_end(container_id)
+            if self.max_size and len(self._containers) > self.max_size:
+                self._containers.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._containers.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+hierarchy_cache = HierarchyCache()
+
+Parents = collections.namedtuple('Parents', ['group', 'project', 'subject', 'session', 'acquisition'])
+
+
+class ContainerRecord:
+    # Lightweight stand-in for an SDK container or file entry with just enough to match
+    # rows and build paths.  hydrate() fetches the full object when it is needed.
+    __slots__ = ('id', 'container_type', 'label', 'name', 'parents', 'parent', 'file_id')
+    
+    def __init__(self, id, container_type, label=None, parents=None, name=None, parent=None,
+                 file_id=None):
+        self.id = id
+        self.container_type = container_type
+        self.label = label
+        self.parents = parents
+        self.name = name
+        self.parent = parent
+        self.file_id = file_id
+    
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+
+def to_record(container):
+    # ContainerRecord for an SDK container or file entry, small enough to pickle
+    if isinstance(container, ContainerRecord):
+        return container
+    
+    if container.get('container_type') == 'file':
+        return file_record(container, to_record(container.parent))
+    
+    # Parent ids repeat across every container of a project, keep one copy of each
+    parents = Parents(*(intern_id(getattr(container.parents, k, None)) for k in Parents._fields))
+    return ContainerRecord(container.id, container.container_type, container.get('label'), parents)
+
+
+def file_record(file_entry, parent):
+    return ContainerRecord(file_entry.get('file_id'), 'file', name=file_entry.name, parent=parent,
+                           file_id=file_entry.get('file_id'))
+
+
+def intern_id(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def reset_hierarchy_cache(max_size=None):
+    global hierarchy_cache
+    hierarchy_cache = HierarchyCache(max_size)
+    return hierarchy_cache
+
+
+def get_cached_container(fw, container_id, level):
+    if container_id is None:
+        return None
+    return hierarchy_cache.get(container_id, lambda: get_level(fw, container_id, level))
+
+
+def get_file_parent(fw, container):
+    # Files carry their parent model; reload it once per parent id instead of once per file.
+    parent = container.parent
+    if isinstance(parent, ContainerRecord):
+        return hierarchy_cache.get(parent.id, lambda: parent)
+    return hierarchy_cache.get(parent.id, lambda: parent.reload())
+
+
+def hydrate(fw, container):
+    # Full SDK object for a ContainerRecord, SDK objects are returned as they are
+    if not isinstance(container, ContainerRecord):
+        return container
+    
+    if container.container_type == 'file':
+        parent = hierarchy_cache.get(container.parent.id, lambda: hydrate(fw, container.parent))
+        if isinstance(parent, ContainerRecord):
+            parent = hydrate(fw, parent)
+            hierarchy_cache.put(parent.id, parent)
+        
+        for file_entry in parent.files:
+            if file_entry.name == container.name:
+                return file_entry
+        raise Exception(f"File {container.name} no longer exists on "
+                        f"{parent.container_type} {parent.label}")
+    
+    return get_level(fw, container.id, container.container_type)
+
+
+def build_mapping_index(fw, containers, mapping_type='label', get_files=False):
+    # Index on whatever the mapping column holds: labels / file names, container /
+    # file ids, or the paths generate_path_to_container reports
+    if mapping_type == 'path':
+        index = {}
+        for container in containers:
+            index.setdefault(generate_path_to_container(fw, container), []).append(container)
+        return index
+    
+    if mapping_type == 'id':
+        key = 'file_id' if get_files else 'id'
+    else:
+        key = 'name' if get_files else 'label'
+    
+    return build_container_index(containers, key)
+
+
+def build_container_index(containers, key):
+    # Multi-map of key value (label or file name) -> every container with that value,
+    # so duplicate and missing keys are still distinguishable after a single lookup.
+    index = {}
+    for container in containers:
+        index.setdefault(container.get(key), []).append(container)
+    
+    return index
+
+
+def find_in_index(index, value):
+    return index.get(value, [])
+
+
+def get_id(container):
+    # File entries are identified by file_id, containers by id
+    if container.get('container_type') == 'file':
+        return container.get('file_id')
+    return container.get('id')
+
+
 def get_containers_at_level(fw, container, level):
     try:
         ct = container.container_type
@@ -81,17 +254,18 @@ def get_parent(fw, container):
     ct = container.get('container_type', 'analysis')
 
     if ct == "project":
-        parent = fw.get_group(container.group)
+        parent = hierarchy_cache.get(container.group, lambda: fw.get_group(container.group))
     elif ct == "subject":
-        parent = fw.get_project(container.project)
+        parent = get_cached_container(fw, container.project, 'project')
     elif ct == "session":
-        parent = container.subject
+        parent = get_subject(fw, container)
     elif ct == "acquisition":
-        parent = container.get_session(container.session)
+        parent = get_cached_container(fw, container.session, 'session')
     elif ct == "analysis":
-        parent = fw.get(container.parent["id"])
+        parent_id = container.parent["id"]
+        parent = hierarchy_cache.get(parent_id, lambda: fw.get(parent_id))
     elif ct == 'file':
-        parent = container.parent.reload()
+        parent = get_file_parent(fw, container)
     else:
         parent = None
 
@@ -107,15 +281,17 @@ def get_subject(fw, container):
     elif ct == "subject":
         subject = container
     elif ct == "session":
-        subject = container.subject
+        # Sessions embed their subject, records only have the id
+        subject = container.get('subject') or get_cached_container(
+            fw, container.parents.subject, 'subject')
     elif ct == "acquisition":
-        subject = fw.get_subject(container.parents.subject)
+        subject = get_cached_container(fw, container.parents.subject, 'subject')
     elif ct == "file":
-        subject = get_subject(container.parent.reload())
+        subject = get_subject(fw, get_file_parent(fw, container))
     elif ct == "analysis":
         sub_id = container.parents.subject
         if sub_id is not None:
-            subject = fw.get_subject(sub_id)
+            subject = get_cached_container(fw, sub_id, 'subject')
         else:
             subject = None
 
@@ -133,13 +309,13 @@ def get_session(fw, container):
     elif ct == "session":
         session = container
     elif ct == "acquisition":
-        session = fw.get_session(container.parents.session)
+        session = get_cached_container(fw, container.parents.session, 'session')
     elif ct == "file":
-        session = get_session(container.parent.reload())
+        session = get_session(fw, get_file_parent(fw, container))
     elif ct == "analysis":
         ses_id = container.parents.session
         if ses_id is not None:
-            session = fw.get_session(ses_id)
+            session = get_cached_container(fw, ses_id, 'session')
         else:
             session = None
 
@@ -153,8 +329,6 @@ def get_session(fw, container):
 def get_acquisition(fw, container):
     ct = container.get('container_type', 'analysis')
     
-    print(container.container_type)
-    
     if ct == "project":
         acquisition = None
     elif ct == "subject":
@@ -164,11 +338,11 @@ def get_acquisition(fw, container):
     elif ct == "acquisition":
         acquisition = container
     elif ct == "file":
-        acquisition = get_acquisition(container.parent.reload())
+        acquisition = get_acquisition(fw, get_file_parent(fw, container))
     elif ct == "analysis":
         ses_id = container.parents.acquisition
         if ses_id is not None:
-            acquisition = fw.get_acquisition(ses_id)
+            acquisition = get_cached_container(fw, ses_id, 'acquisition')
         else:
             acquisition = None
 
@@ -187,7 +361,7 @@ def get_analysis(fw, container):
     elif ct == "acquisition":
         analysis = None
     elif ct == "file":
-        analysis = get_analysis(container.parent.reload())
+        analysis = get_analysis(fw, get_file_parent(fw, container))
     elif ct == "analysis":
         analysis = container
 
@@ -200,15 +374,15 @@ def get_project(fw, container):
     if ct == "project":
         project = container
     elif ct == "subject":
-        project = fw.get_project(container.parents.project)
+        project = get_cached_container(fw, container.parents.project, 'project')
     elif ct == "session":
-        project = fw.get_project(container.parents.project)
+        project = get_cached_container(fw, container.parents.project, 'project')
     elif ct == "acquisition":
-        project = fw.get_project(container.parents.project)
+        project = get_cached_container(fw, container.parents.project, 'project')
     elif ct == "file":
-        project = get_project(container.parent.reload())
+        project = get_project(fw, get_file_parent(fw, container))
     elif ct == "analysis":
-        project = fw.get_project(container.parents.project)
+        project = get_cached_container(fw, container.parents.project, 'project')
 
     return project
 
@@ -268,7 +442,7 @@ def generate_path_to_container(
     if ct == "file":
         path_to_file = generate_path_to_container(
             fw,
-            container.parent.reload(),
+            get_file_parent(fw, container),
             group,
             project,
             subject,
@@ -340,8 +514,8 @@ def generate_path_to_container(
         
         fw_path += append
         
-        # append = f"/{container.label}"
-        # 
-        # fw_path += append
+        # The container itself, analyses were added above
+        if ct in ('project', 'subject', 'session', 'acquisition'):
+            fw_path += f"/{container.label}"
         
     return fw_path
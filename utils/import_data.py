@@ -1,9 +1,11 @@
 import collections.abc
-import numpy as np
+import datetime
 
 import logging
 
-from utils import flywheel_helpers as fh
+from utils import flywheel_helpers as fh, discovery, row_logging as rl
+from utils.metadata_writer import MetadataWriter
+from utils.record_table import RecordTable, RowRecords
 
 # df_path = '/Users/davidparker/Documents/Flywheel/SSE/MyWork/Gears/Metadata_import_Errorprone/Data_Entry_2017_test.csv'
 # firstrow_spec = 1
@@ -12,6 +14,13 @@ from utils import flywheel_helpers as fh
 
 mapping_levels = ['Subject', 'Session', 'Acquisition']
 
+success_statuses = ['Success', 'Unchanged', 'Dry-Run Success']
+status_columns = ['Gear_Sheet', 'Gear_Status', 'Gear_FW_Location']
+
+# Matched containers are fetched by id this many rows at a time, ahead of the rows
+# that update them
+hydrate_window = 1000
+
 log = logging.getLogger("__main__")
 
 
@@ -35,20 +44,19 @@ def expand_metadata(meta_string, container):
     
 
 
-def get_objects_for_processing(fw, destination_container, level, get_files):
+def get_destination_project(fw, destination_container):
+    project = destination_container.parents.project
+    return fw.get(project).reload()
+
+
+def get_objects_for_processing(fw, destination_container, level, get_files, keys=None,
+                               lookup_mode='auto', snapshot=None, mapping_type='label'):
     
     log.debug(f"looking for {level} on container {destination_container.label}.  Files: {get_files}")
     
-    project = destination_container.parents.project
-    project = fw.get(project).reload()
-    child_containers = fh.get_containers_at_level(fw, project, level)
-    if get_files:
-        resulting_containers = []
-        for cc in child_containers:
-            resulting_containers.extend(fh.get_containers_at_level(fw, cc.reload(), "file"))
-        
-    else:
-        resulting_containers = child_containers
+    project = get_destination_project(fw, destination_container)
+    resulting_containers = discovery.discover(fw, project, level, get_files, keys,
+                                              lookup_mode, snapshot, mapping_type)
     
     return resulting_containers
     
@@ -62,7 +70,14 @@ def import_data(fw,
                 get_files=False,
                 metadata_destination="info",
                 overwrite=False,
-                dry_run=False):
+                dry_run=False,
+                max_workers=1,
+                container_index=None,
+                final_report=True,
+                journal=None,
+                completed=None,
+                log_format='verbose',
+                progress=None):
     
     status_log = []
     
@@ -71,113 +86,308 @@ def import_data(fw,
     else:
         name = 'label'
     log.debug(f'found {len(objects_for_processing)} things to search')
+    if container_index is None:
+        container_index = fh.build_container_index(objects_for_processing, name)
     nrows, ncols = df.shape
     log.info("Starting Mapping")
     
-    df['Gear_Status'] = 'Failed'
-    df['Gear_FW_Location'] = None
+    # Columns are pulled out of the frame once as native values and each row's dict is built when it is imported,
+    # statuses and locations are collected in plain lists and attached to the frame in one step at the end.
+    # A previous report's Gear_FW_Location can be the mapping column
+    records = prepare_records(df, [c for c in status_columns if c != mapping_column])
+    keys = records.column(mapping_column)
+    # Use the index labels so chunks of a larger file report their real row
+    row_labels = list(df.index)
+    statuses = ['Failed'] * nrows
+    locations = [None] * nrows
+    
+    # Compact mode logs one line per row outcome and a periodic progress summary
+    # instead of the per-row banners
+    compact = log_format == 'compact'
+    own_progress = compact and progress is None
+    if own_progress:
+        progress = rl.ImportProgress(nrows)
     
     success_counter = 0
+    writer = MetadataWriter(max_workers)
     
-    for row in range(nrows):
+    def log_outcome(position, status, reason=None):
+        if compact:
+            rl.log_row(row_labels[position], keys[position], status,
+                       locations[position], reason)
+            progress.update(status)
+    
+    def record(position, status, container=None, reason=None):
+        if journal is not None:
+            journal.record(keys[position],
+                           status,
+                           fh.get_id(container) if container is not None else None,
+                           locations[position],
+                           row_labels[position])
+        log_outcome(position, status, reason)
+    
+    hydrated = {}
+    for position, upload_obj in enumerate(records):
+        
+        row = row_labels[position]
+        
+        if position % hydrate_window == 0:
+            window = keys[position:position + hydrate_window]
+            hydrated = discovery.hydrate_keys(
+                fw,
+                {key for key in window if not (completed and str(key) in completed)},
+                container_index)
         
         try:
-            upload_obj = df.iloc[row]
-            upload_obj.pop('Gear_Status')
-            upload_obj.pop('Gear_FW_Location')
-            
             object_name = upload_obj.get(mapping_column)
             
-            log.info(f'\n==================================================\n'
-                       f'Setting Metadata For {object_name}\n'
-                       f'--------------------------------------------------')
-            log.info(upload_obj)
+            previous = completed.get(str(object_name)) if completed else None
+            if previous is not None:
+                if not compact:
+                    log.info(f"{object_name} already imported by a previous run. Skipping.")
+                statuses[position] = previous['status']
+                locations[position] = previous.get('location')
+                success_counter += 1
+                log_outcome(position, previous['status'], 'imported by a previous run')
+                continue
+            
+            if not compact:
+                log.info(f'\n==================================================\n'
+                           f'Setting Metadata For {object_name}\n'
+                           f'--------------------------------------------------')
+                log.info(upload_obj)
             
             
-            matches = [m for m in objects_for_processing if m.get(name) == object_name]
+            matches = fh.find_in_index(container_index, object_name)
             
             if len(matches) > 1:
-                log.warning(f"Multiple matches for for object name '{object_name}'. "
-                            f"please get better at specifying flywheel objects.")
-                log.info('\n--------------------------------------------------\n'
-                         'STATUS: Failed\n'
-                         '==================================================\n')
+                if not compact:
+                    log.warning(f"Multiple matches for for object name '{object_name}'. "
+                                f"please get better at specifying flywheel objects.")
+                    log_status_banner('STATUS: Failed')
+                record(position, 'Failed', reason=f"{len(matches)} objects match")
                 continue
                 
             elif len(matches) == 0:
-                log.warning(f"No match for object name '{object_name}'.")
-                log.info('\n--------------------------------------------------\n'
-                         'STATUS: Failed\n'
-                         '==================================================\n')
+                if not compact:
+                    log.warning(f"No match for object name '{object_name}'.")
+                    log_status_banner('STATUS: Failed')
+                record(position, 'Failed', reason='no match')
                 continue
             
-            match = matches[0]
+            match = hydrated.get(fh.get_id(matches[0])) or fh.hydrate(fw, matches[0])
             current_info = match.info
             
             address = fh.generate_path_to_container(fw, match)
-            df.loc[df.index == row, 'Gear_FW_Location'] = address
+            locations[position] = address
             
-            data = upload_obj.to_dict()
+            data = dict(upload_obj)
             
             data.pop(mapping_column)
-
-            
-            levels = metadata_destination.split('.')
-            
-            if levels[0] == "info":
-                levels.pop(0)
-            
-            while levels:
-                info = dict()
-                info[levels.pop(-1)] = data
-                data = info
+            data = nest_metadata(data, metadata_destination)
             
             if dry_run:
-                log.info(f"Would modify info on {address}")
-                df.loc[df.index == row, 'Gear_Status'] = 'Dry-Run Success'
-                log.info('\n--------------------------------------------------\n'
-                         'DRYRUN STATUS: Success\n'
-                         '==================================================\n')
+                if not compact:
+                    log.info(f"Would modify info on {address}")
+                    log_status_banner('DRYRUN STATUS: Success')
+                statuses[position] = 'Dry-Run Success'
+                record(position, 'Dry-Run Success', match)
                 success_counter += 1
             else:
                 
-                log.debug(f'Data from CSV    :\n{current_info}')
-                update_data = update(current_info, data, overwrite)
+                log.debug('Data from CSV    :\n%s', current_info)
+                changes = get_changes(current_info, data, overwrite)
                 
-                log.debug(f'Data after update:\n{update_data}\n')
-                match.update_info(update_data)
-                df.loc[df.index == row, 'Gear_Status'] = 'Success'
-                log.info('\n--------------------------------------------------\n'
-                         'STATUS: Success\n'
-                         '==================================================\n')
-
-                success_counter += 1
+                if not changes:
+                    statuses[position] = 'Unchanged'
+                    if not compact:
+                        log_status_banner('STATUS: Unchanged')
+                    record(position, 'Unchanged', match)
+                    success_counter += 1
+                    continue
+                
+                update_data = update(current_info, changes, overwrite)
+                log.debug('Data after update:\n%s\n', update_data)
+                
+                # update_info sets whole top level keys, so only send the ones that changed
+                update_data = {k: update_data[k] for k in changes}
+                # Journal each write as soon as it lands, not when the chunk finishes
+                def on_done(error, position=position, match=match):
+                    status = 'Success' if error is None else 'Failed'
+                    if not compact:
+                        log_status_banner(f'STATUS: {status} for {keys[position]}')
+                    record(position, status, match, error)
+                
+                writer.submit(position, match, update_data, on_done)
         
         except Exception as e:
-
-            log.warning(f'\n--------------------------------------------------\n'
-                        f'DRYRUN STATUS: Failed\n'
-                        f'row {row} unable to process for reason: {e}'
-                        f'==================================================\n')
             
-            log.exception(e)
+            if compact:
+                log.debug('row %s failed', row, exc_info=True)
+            else:
+                log.warning(f'\n--------------------------------------------------\n'
+                            f'DRYRUN STATUS: Failed\n'
+                            f'row {row} unable to process for reason: {e}'
+                            f'==================================================\n')
+                
+                log.exception(e)
+            record(position, 'Failed', reason=e)
     
+    # Collect the queued writes, statuses are assigned by row so order is preserved
+    try:
+        for position, error in writer.results():
+            if error is None:
+                statuses[position] = 'Success'
+                success_counter += 1
+            elif not compact:
+                log.warning(f'row {row_labels[position]} update failed for reason: {error}')
+    finally:
+        writer.shutdown()
+    
+    df['Gear_Status'] = statuses
+    df['Gear_FW_Location'] = report_locations(keys, locations, mapping_column)
+    
+    if own_progress:
+        progress.finish()
     
+    if final_report:
+        log_final_report(success_counter, nrows)
     
+    return df
+
+
+def report_locations(keys, locations, mapping_column):
+    
+    # When a previous report's Gear_FW_Location is the mapping column, rows that didn't
+    # resolve keep their key, so the report can be imported again
+    if mapping_column != 'Gear_FW_Location':
+        return locations
+    
+    return [key if location is None else location for key, location in zip(keys, locations)]
+
+
+def nest_metadata(data, metadata_destination):
+    
+    # {'a': 1} with destination 'info.x.y' becomes {'x': {'y': {'a': 1}}}
+    levels = metadata_destination.split('.')
+    
+    if levels[0] == "info":
+        levels.pop(0)
+    
+    while levels:
+        info = dict()
+        info[levels.pop(-1)] = data
+        data = info
+    
+    return data
+
+
+def log_status_banner(status):
+    log.info('\n--------------------------------------------------\n'
+             f'{status}\n'
+             '==================================================\n')
+
+
+def count_successes(df):
+    return sum(status in success_statuses for status in df['Gear_Status'])
+
+
+def log_final_report(success_counter, nrows, extra_lines=()):
+    percent = success_counter/nrows*100 if nrows else 0
+    extra = ''.join(f"{line}\n" for line in extra_lines)
     log.info(f"\n\n"
              f"===============================================================================\n"
              f"Final Report: {success_counter}/{nrows} objects updated successfully\n"
-             f"{success_counter/nrows*100}%\n"
+             f"{percent}%\n"
+             f"{extra}"
              f"See output report file for more details\n"
              f"===============================================================================\n")
-    
-    return df
         
         
 
-def save_df_to_csv(df, output_dir):
+def add_sheet_column(df, sheet):
+    # Reports of Excel sheets and zipped tables start with the sheet each row came from
+    if sheet is None:
+        return df
+    df = df.drop(columns=['Gear_Sheet'], errors='ignore')
+    df.insert(0, 'Gear_Sheet', sheet)
+    return df
+
+
+def save_df_to_csv(df, output_dir, append=False):
     output_path = output_dir/'Data_Import_Status_report.csv'
-    df.to_csv(output_path, index=False)
+    if append:
+        df.to_csv(output_path, index=False, mode='a', header=False)
+    else:
+        df.to_csv(output_path, index=False)
+
+
+def to_native(v):
+    # Flywheel doesn't like numpy data types, NaN or datetimes.  NaN and NaT are the
+    # values that aren't equal to themselves.
+    if v is None or v != v:
+        return None
+    if type(v).__module__ == 'numpy':
+        v = v.item()
+    if isinstance(v, float) and v != v:
+        return None
+    if isinstance(v, (datetime.date, datetime.time)):
+        return v.isoformat()
+    return v
+
+
+def native_column(series):
+    
+    # Column values as a list of python types, missing values as None
+    import pandas as pd
+    
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return [None if v is pd.NaT else v.isoformat() for v in series]
+    
+    values = series.tolist()
+    # Categorical and nullable (Int64, boolean...) columns can hold pd.NA, which can't
+    # be compared, so their missing values are taken from the mask
+    if pd.api.types.is_extension_array_dtype(series):
+        missing = series.isna().tolist()
+        return [None if m else to_native(v) for v, m in zip(values, missing)]
+    # tolist() already unboxes numeric and boolean columns
+    if series.dtype == object:
+        return [to_native(v) for v in values]
+    if series.hasnans:
+        return [None if v != v else v for v in values]
+    
+    return values
+
+
+def prepare_records(df, exclude_columns=()):
+    
+    # One pass per column instead of converting every value of every row, so the
+    # import loop only ever sees dicts of native values.  Columns are taken by
+    # position since df[name] returns a frame when a header is repeated.
+    if isinstance(df, RecordTable):
+        return df.records(exclude_columns)
+    
+    positions = [i for i, c in enumerate(df.columns) if c not in exclude_columns]
+    columns = [df.columns[i] for i in positions]
+    values = [native_column(df.iloc[:, i]) for i in positions]
+    
+    return RowRecords(columns, values, len(df))
+
+
+def get_changes(d, u, overwrite):
+    
+    # The part of u that update() would actually change in d, without modifying d
+    changes = {}
+    for k, v in u.items():
+        if isinstance(v, collections.abc.Mapping):
+            sub_changes = get_changes(d.get(k, {}), v, overwrite)
+            if sub_changes or k not in d:
+                changes[k] = sub_changes
+        else:
+            if k not in d or (overwrite and d[k] != v):
+                changes[k] = v
+    
+    return changes
 
 
 def update(d, u, overwrite):
@@ -186,19 +396,15 @@ def update(d, u, overwrite):
         if isinstance(v, collections.abc.Mapping):
             d[k] = update(d.get(k, {}), v, overwrite)
         else:
-            # Flywheel doesn't like numpy data types:
-            if type(v).__module__ == np.__name__:
-                v = v.item()
-            
-            log.debug(f'checking if "{k}" in {d.keys()}')
+            log.debug('checking if "%s" in %s', k, d.keys())
             if k in d:
                 if overwrite:
-                    log.debug(f'Overwriting "{k}" from "{d[k]}" to "{v}"')
+                    log.debug('Overwriting "%s" from "%s" to "%s"', k, d[k], v)
                     d[k] = v
                 else:
-                    log.debug(f'"{k}" present.  Skipping.')
+                    log.debug('"%s" present.  Skipping.', k)
             else:
-                log.debug(f"setting {k}")
+                log.debug("setting %s", k)
                 d[k] = v
         
     return d
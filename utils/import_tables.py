@@ -0,0 +1,259 @@
+import logging
+from pathlib import Path
+import pathvalidate as pv
+
+from utils import load_data as ld, import_data as id, flywheel_helpers as fh, preflight as pf
+from utils import journal as jn, instrumentation, row_logging as rl, sharding
+
+log = logging.getLogger("__main__")
+
+
+def import_sheets(fw,
+                  tables,
+                  objects_for_processing,
+                  container_index,
+                  attached_files,
+                  overwrite,
+                  dry_run,
+                  max_workers,
+                  journal,
+                  completed,
+                  log_format,
+                  shards=1,
+                  api_key=None,
+                  api_stats=None,
+                  mapping_type='label'):
+    
+    # Imports the sheets of one file one after the other, each row is its own update
+    
+    # Sharded imports report progress per shard
+    progress = None
+    if log_format == 'compact' and shards <= 1:
+        progress = rl.ImportProgress(sum(len(table.df) for table in tables))
+    
+    reports = []
+    for table in tables:
+        if table.name is not None:
+            log.info(f"Importing sheet {table.name}")
+        journal.sheet = table.name
+        table_completed = completed.get(table.name)
+        
+        if shards > 1:
+            options = {
+                'attached_files': attached_files,
+                'metadata_destination': table.destination,
+                'overwrite': overwrite,
+                'dry_run': dry_run,
+                'max_workers': max_workers,
+                'log_format': log_format,
+                'mapping_type': mapping_type,
+            }
+            df = sharding.import_sharded(fw,
+                                         api_key,
+                                         table.df,
+                                         table.mapping_column,
+                                         container_index,
+                                         shards,
+                                         options,
+                                         journal,
+                                         table_completed,
+                                         api_stats)
+        else:
+            df = id.import_data(fw,
+                                table.df,
+                                table.mapping_column,
+                                objects_for_processing,
+                                attached_files,
+                                table.destination,
+                                overwrite,
+                                dry_run,
+                                max_workers,
+                                container_index=container_index,
+                                journal=journal,
+                                completed=table_completed,
+                                final_report=False,
+                                log_format=log_format,
+                                progress=progress)
+        
+        reports.append(id.add_sheet_column(df, table.name))
+    
+    if progress is not None:
+        progress.finish()
+    
+    return reports
+
+
+def report_lines(api_stats, governor, timer):
+    # Extra lines for the final report: API calls, rate control and time per phase
+    return api_stats.report_lines() + governor.report_lines() + timer.report_lines()
+
+
+def combine_reports(reports):
+    
+    if len(reports) == 1:
+        return reports[0]
+    
+    # Tables can have different columns, keep the statuses last
+    import pandas as pd
+    df = pd.concat(reports, ignore_index=True)
+    return df[[c for c in df.columns if c not in id.status_columns[1:]] + id.status_columns[1:]]
+
+
+def table_destination(stem, metadata_destination=None):
+    
+    # Zipped tables go to info.<file name>, under metadata_destination when it's set
+    destination = pv.sanitize_filename(stem).replace(' ', '_') or 'table'
+    if metadata_destination:
+        destination = f"{metadata_destination}.{destination}"
+    
+    return destination
+
+
+def zip_destinations(members, metadata_destination=None):
+    
+    # Destination of every file in a zip.  Sheets of one workbook share theirs, but two
+    # files named alike in different folders would write over each other's metadata.
+    destinations = {}
+    owners = {}
+    for member in members:
+        if member in destinations:
+            continue
+        destination = table_destination(Path(member).stem, metadata_destination)
+        if destination in owners:
+            log.error(f"{owners[destination]} and {member} would both be imported to "
+                      f"info.{destination}.  Rename one of them.")
+            raise Exception("Zipped tables with the same destination")
+        destinations[member] = destination
+        owners[destination] = member
+    
+    return destinations
+
+
+def load_completed(previous_journal, journal, metadata_destination, sheet=None):
+    
+    # Rows a previous job already committed, copied into this job's journal so it is
+    # complete on its own and can be resumed from again.
+    if previous_journal is None:
+        return None
+    
+    completed = jn.load_journal(previous_journal, metadata_destination, sheet)
+    if completed and Path(previous_journal) != journal.path:
+        journal.carry_over(completed)
+    
+    return completed
+
+
+def pending_keys(keys, completed):
+    
+    # The keys of rows still to import, in their original order
+    if not completed:
+        return list(keys)
+    
+    return [key for key in keys if str(key) not in completed]
+
+
+def discover_matches(fw,
+                     dest_container,
+                     key_sets,
+                     object_type,
+                     attached_files,
+                     lookup_mode,
+                     snapshot,
+                     mapping_type,
+                     report_output,
+                     min_match_rate,
+                     timer):
+    
+    # Finds the objects for every key and checks the matches before anything is written.
+    # key_sets is [(sheet name or None, keys)], as for preflight.check_matches.  Returns
+    # the objects and their mapping index.
+    keys = set()
+    for _, sheet_keys in key_sets:
+        keys.update(sheet_keys)
+    
+    with timer.phase('discover'):
+        objects_for_processing = id.get_objects_for_processing(fw,
+                                                               dest_container,
+                                                               object_type,
+                                                               attached_files,
+                                                               keys,
+                                                               lookup_mode,
+                                                               snapshot,
+                                                               mapping_type)
+        
+        container_index = fh.build_mapping_index(fw, objects_for_processing, mapping_type,
+                                                 attached_files)
+    timer.count('discover', len(objects_for_processing), 'containers')
+    
+    with timer.phase('preflight'):
+        nkeys = pf.check_matches(key_sets, container_index, report_output, min_match_rate)
+    timer.count('preflight', nkeys, 'keys')
+    
+    return objects_for_processing, container_index
+
+
+def import_in_chunks(fw,
+                     csv_file,
+                     first_row,
+                     delimiter,
+                     chunk_size,
+                     mapping_column,
+                     objects_for_processing,
+                     container_index,
+                     attached_files,
+                     metadata_destination,
+                     overwrite,
+                     dry_run,
+                     max_workers,
+                     report_output,
+                     journal=None,
+                     completed=None,
+                     log_format='verbose',
+                     nrows_expected=None,
+                     timer=None,
+                     column_types=None):
+    
+    # Only one chunk of the CSV is in memory at a time, each chunk's statuses are
+    # appended to the report before the next one is read.
+    if timer is None:
+        timer = instrumentation.PhaseTimer()
+    progress = rl.ImportProgress(nrows_expected) if log_format == 'compact' else None
+    
+    success_counter = 0
+    nrows = 0
+    chunks = ld.iter_text_dataframe(csv_file, first_row, delimiter, chunk_size, column_types)
+    chunk_number = 0
+    while True:
+        with timer.phase('load'):
+            df = next(chunks, None)
+        if df is None:
+            break
+        
+        with timer.phase('import'):
+            df = id.import_data(fw,
+                                df,
+                                mapping_column,
+                                objects_for_processing,
+                                attached_files,
+                                metadata_destination,
+                                overwrite,
+                                dry_run,
+                                max_workers,
+                                container_index=container_index,
+                                final_report=False,
+                                journal=journal,
+                                completed=completed,
+                                log_format=log_format,
+                                progress=progress)
+        timer.count('import', len(df), 'rows')
+        
+        success_counter += id.count_successes(df)
+        nrows += len(df)
+        with timer.phase('report'):
+            id.save_df_to_csv(df, report_output, append=chunk_number > 0)
+        chunk_number += 1
+    
+    if progress is not None:
+        progress.finish()
+    
+    return success_counter, nrows
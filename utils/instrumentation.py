@@ -0,0 +1,182 @@
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+
+log = logging.getLogger("__main__")
+
+stats_name = 'Data_Import_API_stats.json'
+
+# Gear modules that wrap call_api themselves, skipped when naming the SDK method
+wrapper_modules = ('utils.rate_control',)
+
+
+class ApiCallStats:
+    # Call count, total time and latency distribution for every SDK method / endpoint
+    def __init__(self):
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._latencies.setdefault(name, []).append(seconds)
+
+    def export(self):
+        # Raw latencies, picklable so worker processes can send theirs back
+        with self._lock:
+            return {name: list(values) for name, values in self._latencies.items()}
+
+    def merge(self, latencies):
+        with self._lock:
+            for name, values in latencies.items():
+                self._latencies.setdefault(name, []).extend(values)
+
+    def summary(self):
+        with self._lock:
+            latencies = {name: sorted(values) for name, values in self._latencies.items()}
+
+        calls = {}
+        for name, values in latencies.items():
+            total = sum(values)
+            calls[name] = {
+                'count': len(values),
+                'total_seconds': round(total, 3),
+                'mean_ms': round(total / len(values) * 1000, 2),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p90_ms': round(percentile(values, 90) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+                'max_ms': round(values[-1] * 1000, 2),
+            }
+        calls = dict(sorted(calls.items(), key=lambda item: -item[1]['total_seconds']))
+
+        return {
+            'total_calls': sum(c['count'] for c in calls.values()),
+            'total_seconds': round(sum(c['total_seconds'] for c in calls.values()), 3),
+            'calls': calls,
+        }
+
+    def save(self, output_dir, run_time=None):
+        # run_time is a PhaseTimer summary, saved alongside the API calls
+        summary = self.summary()
+        if run_time is not None:
+            summary['run_time'] = run_time
+        output_path = output_dir/stats_name
+        with open(output_path, 'w') as stats_file:
+            json.dump(summary, stats_file, indent=2)
+        return output_path
+
+    def report_lines(self, top=10):
+        summary = self.summary()
+        lines = [f"API calls: {summary['total_calls']} "
+                 f"({summary['total_seconds']}s total request time)"]
+        for name, c in list(summary['calls'].items())[:top]:
+            lines.append(f"  {c['count']:>7} x {name}: {c['total_seconds']}s, "
+                         f"p50 {c['p50_ms']}ms, p99 {c['p99_ms']}ms")
+        return lines
+
+
+class PhaseTimer:
+    # Wall time spent in each phase of the run (load, validate, discover...), in the
+    # order the phases first ran.  A phase entered several times, like the load and
+    # import of each chunk, adds up.  count() records what a phase got through so the
+    # report can give a rate.
+    def __init__(self):
+        self._seconds = {}
+        self._counts = {}
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._seconds[name] = self._seconds.get(name, 0) + time.perf_counter() - start
+
+    def count(self, name, items, unit):
+        previous = self._counts.get(name, (0, unit))[0]
+        self._counts[name] = (previous + items, unit)
+
+    def summary(self):
+        phases = {}
+        for name, seconds in self._seconds.items():
+            phases[name] = {'seconds': round(seconds, 3)}
+            if name in self._counts:
+                items, unit = self._counts[name]
+                phases[name][unit] = items
+                phases[name][f"{unit}_per_second"] = round(items / seconds, 1) if seconds else None
+        return {
+            'total_seconds': round(time.perf_counter() - self._start, 3),
+            'phases': phases,
+        }
+
+    def report_lines(self):
+        summary = self.summary()
+        lines = [f"Run time: {summary['total_seconds']}s"]
+        for name, phase in summary['phases'].items():
+            line = f"  {name}: {phase['seconds']}s"
+            if name in self._counts:
+                items, unit = self._counts[name]
+                rate = phase[f"{unit}_per_second"]
+                line += f", {items} {unit}" + (f" ({rate:.0f} {unit}/s)" if rate is not None else '')
+            lines.append(line)
+        return lines
+
+
+def percentile(sorted_values, percent):
+    # Nearest rank
+    rank = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def get_sdk_method(frame):
+    # Walk up from the HTTP call to the first frame in this gear's code.  The frame
+    # just below it is the SDK method the gear called (fw.get, iter_find, reload...).
+    sdk_frame = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module in wrapper_modules:
+            frame = frame.f_back
+            continue
+        if module in ('run', '__main__') or module.startswith('utils.'):
+            break
+        sdk_frame = frame
+        frame = frame.f_back
+
+    if sdk_frame is None:
+        return 'unknown'
+
+    name = sdk_frame.f_code.co_name
+    owner = sdk_frame.f_locals.get('self')
+    if owner is not None:
+        name = f"{type(owner).__name__}.{name}"
+    return name
+
+
+def wrap_call_api(fw, wrap):
+    # Every SDK request, including the ones made by container methods like reload()
+    # and update_info(), goes through the client's api_client.call_api.  wrap gets
+    # the current call_api and returns the function that replaces it.
+    api_client = fw.api_client
+    api_client.call_api = wrap(api_client.call_api)
+
+
+def instrument_client(fw, stats=None):
+    if stats is None:
+        stats = ApiCallStats()
+
+    def timed(call_api):
+        def timed_call_api(resource_path, method, *args, **kwargs):
+            name = f"{get_sdk_method(sys._getframe(1))} ({method} {resource_path})"
+            start = time.perf_counter()
+            try:
+                return call_api(resource_path, method, *args, **kwargs)
+            finally:
+                stats.record(name, time.perf_counter() - start)
+        return timed_call_api
+
+    wrap_call_api(fw, timed)
+
+    return stats
@@ -0,0 +1,77 @@
+import json
+import logging
+import threading
+from pathlib import Path
+
+log = logging.getLogger("__main__")
+
+journal_name = 'Data_Import_Journal.jsonl'
+
+# Outcomes that mean the row's metadata is already on the container
+committed_statuses = ['Success', 'Unchanged']
+
+
+class ImportJournal:
+    # Append-only JSON lines record of every row outcome.  Each line is flushed as
+    # soon as it is written so a job that dies partway leaves a usable journal.
+    def __init__(self, path, destination):
+        self.path = Path(path)
+        self.destination = destination
+        # Set while importing each sheet of an Excel file, keys only need to be
+        # unique within a sheet
+        self.sheet = None
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a')
+
+    def record(self, key, status, container_id=None, location=None, row=None, sheet=None):
+        entry = {
+            'row': row,
+            'key': str(key),
+            'destination': self.destination,
+            'container_id': container_id,
+            'location': location,
+            'status': status,
+        }
+        sheet = sheet if sheet is not None else self.sheet
+        if sheet is not None:
+            entry['sheet'] = sheet
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def carry_over(self, entries):
+        # Copy committed entries from a previous journal so the new one is complete
+        # on its own and the import can be resumed again from it.
+        with self._lock:
+            for entry in entries.values():
+                self._file.write(json.dumps(entry, default=str) + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def load_journal(path, destination, sheet=None):
+    # Returns {key: entry} for rows already committed to the same destination (and sheet).
+    committed = {}
+    with open(path, 'r') as journal_file:
+        for line_number, line in enumerate(journal_file):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line can be cut off if the previous job was killed mid-write
+                log.warning(f"Skipping unreadable journal line {line_number + 1}")
+                continue
+            if entry.get('destination') != destination or entry.get('sheet') != sheet:
+                continue
+            if entry.get('status') in committed_statuses:
+                committed[entry['key']] = entry
+
+    log.info(f"Loaded journal {path}: {len(committed)} rows already imported")
+
+    return committed
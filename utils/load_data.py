@@ -1,5 +1,15 @@
-import pandas as pd
+import concurrent.futures
+import json
 import logging
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+
+from utils import record_table as rt
+
+# pandas and openpyxl are a large share of the gear's start up time, they are
+# imported in the functions that use them so small text files never load them.
 
 log=logging.getLogger(__name__)
 
@@ -10,23 +20,276 @@ firstrow_spec = 14
 sheets_spec = "MRIDataTracker"
 
 
-def load_excel_dataframe(excel_path, firstrow_spec, sheets_spec=0):
+excel_extensions = ['.xlsx', '.xlsm']
+text_extensions = ['.csv', '.tsv', '.txt']
+
+# Text files with up to this many rows are read with the csv module instead of pandas
+small_file_rows = 10000
+
+# column_types names -> the dtype the column is stored as.  Numbers and booleans use
+# pandas' nullable types, so a missing value doesn't make the column float or object.
+column_dtypes = {
+    'str': str,
+    'int': 'Int64',
+    'float': 'float64',
+    'bool': 'boolean',
+    'category': 'category',
+    'datetime': None,
+}
+# Types read_table applies while parsing, text has to be kept as it is in the file
+# (leading zeros...).  The others are cast from the parsed column, which is faster.
+parse_types = {'str', 'category'}
+# Text columns with at most this share of distinct values are stored as categoricals,
+# columns whose first category_sample rows are more varied than that aren't tried
+category_ratio = 0.5
+category_sample = 1000
+
+
+def parse_column_types(spec):
     
-    # First iteration only supports single sheet import, but sheet can be specified.
+    # The column_types config: a JSON object of column name -> one of column_dtypes
+    if not spec:
+        return {}
     
-    df = pd.read_excel(excel_path, header=firstrow_spec-1, sheet_name=sheets_spec)
-    df = df.where(pd.notnull(df), None)
+    try:
+        column_types = json.loads(spec)
+    except ValueError:
+        log.error(f"column_types is not valid JSON: {spec}")
+        raise Exception("Invalid column_types")
     
-    return df
+    if not isinstance(column_types, dict):
+        log.error(f"column_types must be a JSON object of column name: type, got {spec}")
+        raise Exception("Invalid column_types")
+    
+    unknown = {column: type_name for column, type_name in column_types.items()
+               if type_name not in column_dtypes}
+    if unknown:
+        log.error(f"Unknown column types {unknown}, expected one of {', '.join(column_dtypes)}")
+        raise Exception("Invalid column_types")
+    
+    return column_types
 
-def load_text_dataframe(df_path, firstrow_spec, delimiter_spec):
+
+def read_dtypes(column_types):
+    
+    # dtype argument of read_table, columns that aren't in the file are ignored
+    dtypes = {column: column_dtypes[type_name] for column, type_name in column_types.items()
+              if type_name in parse_types}
+    return dtypes or None
+
+
+def typed_column(series, type_name):
+    
+    import pandas as pd
+    
+    if type_name == 'datetime':
+        return pd.to_datetime(series)
+    if type_name == 'str':
+        return series.map(str, na_action='ignore')
+    return series.astype(column_dtypes[type_name])
+
+
+def set_column_types(df, column_types, parsed=False):
+    
+    # Converts the columns column_types names, parsed means read_table already applied
+    # parse_types.  Missing values stay NaN / NA, import_data turns them into None when
+    # the rows are serialized.
+    for column, type_name in column_types.items():
+        if column in df and not (parsed and type_name in parse_types):
+            df[column] = typed_column(df[column], type_name)
     
-    df = pd.read_table(df_path, delimiter=delimiter_spec, header=firstrow_spec-1)
-    df = df.where(pd.notnull(df), None)
+    return df
+
 
+def compact_text_columns(df):
+    
+    # Repetitive text (sites, visit names, yes/no...) is stored as categoricals, one
+    # copy of each distinct string instead of one object per cell
+    import pandas as pd
+    
+    if not df.columns.is_unique:
+        return df
+    
+    for column in df.columns:
+        series = df[column]
+        if (not pd.api.types.is_string_dtype(series)
+                or isinstance(series.dtype, pd.CategoricalDtype)):
+            continue
+        sample = series.iloc[:category_sample]
+        if sample.nunique() > len(sample) * category_ratio:
+            continue
+        categorical = series.astype('category')
+        categories = categorical.cat.categories
+        if (len(categories) <= len(series) * category_ratio
+                and pd.api.types.infer_dtype(categories) == 'string'):
+            df[column] = categorical
+    
     return df
 
-def validate_df(df, object_col):
+
+def is_excel_file(df_path):
+    return Path(df_path).suffix.lower() in excel_extensions
+
+
+def get_sheet_names(excel_path, sheets_spec):
+    
+    # sheets_spec is a comma separated list of sheet names, "*" for every sheet, a
+    # sheet position, or empty for the first sheet.
+    import openpyxl
+    
+    workbook = openpyxl.load_workbook(excel_path, read_only=True)
+    try:
+        available = workbook.sheetnames
+    finally:
+        workbook.close()
+    
+    if isinstance(sheets_spec, int):
+        if not -len(available) <= sheets_spec < len(available):
+            log.error(f"Sheet {sheets_spec} not found in {Path(excel_path).name}, "
+                      f"it has {len(available)} sheets")
+            raise Exception("Sheet not in Excel file")
+        return [available[sheets_spec]]
+    if not sheets_spec:
+        return available[:1]
+    if sheets_spec.strip() == '*':
+        return available
+    
+    sheet_names = [name.strip() for name in sheets_spec.split(',') if name.strip()]
+    missing = [name for name in sheet_names if name not in available]
+    if missing:
+        log.error(f"Sheets {missing} not found in {Path(excel_path).name}, available: {available}")
+        raise Exception("Sheet not in Excel file")
+    
+    return sheet_names
+
+
+def read_excel_sheet(excel_path, sheet_name, firstrow_spec, column_types=None):
+    
+    # Read-only mode streams rows from the sheet's XML instead of loading the whole
+    # workbook, values_only skips building cell objects.
+    import openpyxl
+    import pandas as pd
+    
+    workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(min_row=firstrow_spec, values_only=True)
+        header = next(rows, ())
+        data = [row for row in rows if any(v is not None for v in row)]
+    finally:
+        workbook.close()
+    
+    # Sheets often report formatted but empty trailing columns
+    width = len(header)
+    while width and header[width-1] is None and all(
+            len(row) < width or row[width-1] is None for row in data):
+        width -= 1
+    
+    columns = [h if h is not None else f"Unnamed: {i}" for i, h in enumerate(header[:width])]
+    df = pd.DataFrame([row[:width] for row in data], columns=columns)
+    
+    # Cells are already python values, every type is applied after reading
+    return compact_text_columns(set_column_types(df, column_types or {}))
+
+
+def load_excel_sheets(excel_path, firstrow_spec, sheets_spec=None, column_types=None):
+    
+    # Returns {sheet name: dataframe}, several sheets are parsed in parallel processes
+    sheet_names = get_sheet_names(excel_path, sheets_spec)
+    log.info(f"Reading sheets {sheet_names} from {Path(excel_path).name}")
+    
+    if len(sheet_names) == 1:
+        frames = [read_excel_sheet(excel_path, sheet_names[0], firstrow_spec, column_types)]
+    else:
+        workers = min(len(sheet_names), os.cpu_count() or 1)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            frames = list(executor.map(read_excel_sheet,
+                                       [excel_path] * len(sheet_names),
+                                       sheet_names,
+                                       [firstrow_spec] * len(sheet_names),
+                                       [column_types] * len(sheet_names)))
+    
+    return dict(zip(sheet_names, frames))
+
+
+def load_excel_dataframe(excel_path, firstrow_spec, sheets_spec=0):
+    
+    # Single sheet, the first one unless a sheet name or position is given
+    sheets = load_excel_sheets(excel_path, firstrow_spec, sheets_spec)
+    return next(iter(sheets.values()))
+
+def is_zip_file(df_path):
+    return Path(df_path).suffix.lower() == '.zip'
+
+
+def load_zip_tables(zip_path, firstrow_spec, delimiter_spec, sheets_spec=None, column_types=None):
+    
+    # Returns [(table name, archive member, dataframe)] for every text file and Excel sheet
+    # in the archive.  Tables are named by their path in the archive, plus the sheet
+    # when a workbook has several.
+    tables = []
+    with tempfile.TemporaryDirectory() as extract_dir, zipfile.ZipFile(zip_path) as archive:
+        members = sorted(m for m in archive.namelist()
+                         if not m.endswith('/') and not m.startswith('__MACOSX/')
+                         and not Path(m).name.startswith('.'))
+        for member in members:
+            suffix = Path(member).suffix.lower()
+            if suffix not in text_extensions + excel_extensions:
+                log.info(f"Skipping {member}, not a table")
+                continue
+            
+            table_path = archive.extract(member, extract_dir)
+            if suffix in excel_extensions:
+                sheets = load_excel_sheets(table_path, firstrow_spec, sheets_spec, column_types)
+                for sheet, df in sheets.items():
+                    name = member if len(sheets) == 1 else f"{member}:{sheet}"
+                    tables.append((name, member, df))
+            else:
+                tables.append((member, member, load_text_dataframe(table_path, firstrow_spec,
+                                                                  delimiter_spec, column_types)))
+    
+    if not tables:
+        log.error(f"No CSV, text or Excel files found in {Path(zip_path).name}")
+        raise Exception("No tables in zip file")
+    log.info(f"Loaded {len(tables)} tables from {Path(zip_path).name}")
+    
+    return tables
+
+
+def load_text_table(df_path, firstrow_spec, delimiter_spec, column_types=None):
+    
+    # A RecordTable for small files, so pandas isn't imported, a DataFrame otherwise
+    table = rt.read_small_csv(df_path, firstrow_spec, delimiter_spec, small_file_rows,
+                              column_types)
+    if table is not None:
+        return table
+    
+    return load_text_dataframe(df_path, firstrow_spec, delimiter_spec, column_types)
+
+
+def load_text_dataframe(df_path, firstrow_spec, delimiter_spec, column_types=None):
+    
+    # Columns keep their parsed dtypes and missing values, see set_column_types
+    import pandas as pd
+    
+    column_types = column_types or {}
+    df = pd.read_table(df_path, delimiter=delimiter_spec, header=firstrow_spec-1,
+                       dtype=read_dtypes(column_types))
+
+    return compact_text_columns(set_column_types(df, column_types, parsed=True))
+
+def iter_text_dataframe(df_path, firstrow_spec, delimiter_spec, chunk_size, column_types=None):
+    
+    # Chunks keep their position in the file as their index
+    import pandas as pd
+    
+    column_types = column_types or {}
+    reader = pd.read_table(df_path, delimiter=delimiter_spec, header=firstrow_spec-1,
+                           dtype=read_dtypes(column_types), chunksize=chunk_size)
+    for df in reader:
+        yield compact_text_columns(set_column_types(df, column_types, parsed=True))
+
+
+def validate_df(df, object_col, column_types=None):
     
     if object_col == "" or object_col is None:
         log.info('No object column specified, assuming column 1')
@@ -37,12 +300,42 @@ def validate_df(df, object_col):
         log.error(f"Specified column {object_col} not found in CSV file")
         raise Exception("Column not in CSV")
     
+    missing = [column for column in column_types or {} if column not in df]
+    if missing:
+        log.warning(f"column_types names columns that are not in the file: {missing}")
+    
     series = df[object_col]
     if len(series) != series.nunique():
         log.error(f"Non-unique object names in mapping column.  Filenames must be unique.")
         raise Exception("Object Mappings Must Be Unique")
     
     return object_col
+
+
+def validate_text_file(df_path, firstrow_spec, delimiter_spec, object_col, chunk_size,
+                       column_types=None):
+    
+    # Streaming version of validate_df, only the mapping column is read so the whole
+    # file is validated before anything is written.  Returns the column and its values.
+    import pandas as pd
+    
+    header = pd.read_table(df_path, delimiter=delimiter_spec, header=firstrow_spec-1, nrows=0)
+    object_col = validate_df(header, object_col, column_types)
+    
+    # The keys must be read as the same type as the rows that are imported
+    key_types = {c: t for c, t in (column_types or {}).items() if c == object_col}
+    seen = set()
+    reader = pd.read_table(df_path, delimiter=delimiter_spec, header=firstrow_spec-1,
+                           usecols=[object_col], dtype=read_dtypes(key_types),
+                           chunksize=chunk_size)
+    for chunk in reader:
+        series = set_column_types(chunk, key_types, parsed=True)[object_col]
+        if len(series) != series.nunique() or not seen.isdisjoint(series):
+            log.error("Non-unique object names in mapping column.  Filenames must be unique.")
+            raise Exception("Object Mappings Must Be Unique")
+        seen.update(series)
+    
+    return object_col, seen
     
 
 
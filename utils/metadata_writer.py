@@ -0,0 +1,39 @@
+import concurrent.futures
+import logging
+import threading
+
+log = logging.getLogger("__main__")
+
+
+class MetadataWriter:
+    # Sends update_info calls through a bounded thread pool.  Results are kept
+    # per row so statuses can be written back in the original row order.  Transient
+    # errors are retried by the client's rate governor (see rate_control).
+    def __init__(self, max_workers=1):
+        self.max_workers = max(1, max_workers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        # Limit queued updates so large imports don't hold every payload in memory
+        self._slots = threading.BoundedSemaphore(self.max_workers * 4)
+        self._futures = {}
+
+    def submit(self, row, container, update_data, on_done=None):
+        # on_done(error) is called from the worker thread as soon as the write finishes
+        self._slots.acquire()
+        future = self._executor.submit(self._write, container, update_data)
+        future.add_done_callback(lambda f: self._slots.release())
+        if on_done is not None:
+            future.add_done_callback(lambda f: on_done(f.exception()))
+        self._futures[row] = future
+
+    def _write(self, container, update_data):
+        container.update_info(update_data)
+
+    def results(self):
+        # Blocks until every submitted update is done.  Yields (row, error) in
+        # row order, error is None for successful writes.
+        for row in sorted(self._futures):
+            yield row, self._futures[row].exception()
+        self._futures = {}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
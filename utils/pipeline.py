@@ -0,0 +1,113 @@
+import logging
+import queue
+import threading
+
+from utils import flywheel_helpers as fh, import_data as id, discovery, row_logging as rl
+
+log = logging.getLogger("__main__")
+
+# Discovered batches waiting to be imported, discovery pauses when this many are queued
+queue_size = 4
+
+_done = object()
+
+
+def discover_in_background(fw, project, level, get_files, keys, lookup_mode, snapshot,
+                           mapping_type='label'):
+
+    # Runs discovery on a thread, returns a queue of (keys, objects) ending with _done,
+    # or the exception that stopped discovery.
+    batches = queue.Queue(maxsize=queue_size)
+
+    def produce():
+        try:
+            for batch in discovery.iter_discover(fw, project, level, get_files, keys,
+                                                 lookup_mode, snapshot, mapping_type):
+                batches.put(batch)
+        except Exception as e:
+            batches.put(e)
+        else:
+            batches.put(_done)
+
+    threading.Thread(target=produce, name='discovery', daemon=True).start()
+
+    return batches
+
+
+def import_pipelined(fw,
+                     df,
+                     mapping_column,
+                     destination_container,
+                     level,
+                     get_files=False,
+                     metadata_destination="info",
+                     overwrite=False,
+                     dry_run=False,
+                     max_workers=1,
+                     lookup_mode='auto',
+                     snapshot=None,
+                     journal=None,
+                     completed=None,
+                     log_format='verbose',
+                     mapping_type='label'):
+
+    # Imports the rows for each batch of keys as soon as discovery has found all of
+    # their matches, while the next batches are still being searched for.  In 'auto'
+    # mode keys are always looked up in batches so writes can start right away.
+    project = id.get_destination_project(fw, destination_container)
+    if lookup_mode == 'auto':
+        lookup_mode = 'targeted'
+
+    positions = {}
+    for label, key in zip(df.index, df[mapping_column]):
+        positions.setdefault(str(key), []).append(label)
+
+    progress = rl.ImportProgress(len(df)) if log_format == 'compact' else None
+    # Rows a previous job committed are imported with the last batch, without a lookup
+    keys = {key for key in df[mapping_column] if not (completed and str(key) in completed)}
+    batches = discover_in_background(fw, project, level, get_files, keys,
+                                     lookup_mode, snapshot, mapping_type)
+
+    frames = []
+    remaining = set(positions)
+    while True:
+        batch = batches.get()
+        if batch is _done:
+            break
+        if isinstance(batch, Exception):
+            raise batch
+
+        keys, objects = batch
+        if keys is None:
+            # The rest of the rows can be matched now, the last frame is always
+            # imported so even an empty CSV gets its status columns
+            keys = set(remaining)
+        else:
+            keys = remaining.intersection(keys)
+            if not keys:
+                continue
+        remaining -= keys
+
+        labels = sorted(label for key in keys for label in positions[key])
+        frames.append(id.import_data(fw,
+                                     df.loc[labels],
+                                     mapping_column,
+                                     objects,
+                                     get_files,
+                                     metadata_destination,
+                                     overwrite,
+                                     dry_run,
+                                     max_workers,
+                                     container_index=fh.build_mapping_index(
+                                         fw, objects, mapping_type, get_files),
+                                     final_report=False,
+                                     journal=journal,
+                                     completed=completed,
+                                     log_format=log_format,
+                                     progress=progress))
+
+    if progress is not None:
+        progress.finish()
+
+    import pandas as pd
+    return pd.concat(frames).loc[df.index]
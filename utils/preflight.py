@@ -0,0 +1,61 @@
+import csv
+import logging
+
+from utils import flywheel_helpers as fh
+
+log = logging.getLogger("__main__")
+
+report_name = 'Data_Import_Unmatched_report.csv'
+# Ids of an ambiguous key's matches listed in the report
+max_candidates = 10
+
+
+def find_problems(keys, container_index):
+    # (key, matches) for every key that doesn't match exactly one object, one index
+    # lookup per key
+    problems = []
+    for key in keys:
+        matches = fh.find_in_index(container_index, key)
+        if len(matches) != 1:
+            problems.append((key, matches))
+
+    return problems
+
+
+def check_matches(key_sets, container_index, output_dir, min_match_rate=0):
+    # key_sets is [(sheet name or None, mapping column keys)].  Every key is resolved
+    # before anything is written: the ones with no match or several go to report_name,
+    # and the import stops when under min_match_rate percent of the keys match.
+    # Returns the number of keys checked.
+    sheets = any(sheet is not None for sheet, _ in key_sets)
+    rows = []
+    nkeys = 0
+    for sheet, keys in key_sets:
+        nkeys += len(keys)
+        for key, matches in find_problems(keys, container_index):
+            row = [key,
+                   'ambiguous' if matches else 'no match',
+                   len(matches),
+                   ' '.join(str(fh.get_id(m)) for m in matches[:max_candidates])]
+            rows.append([sheet] + row if sheets else row)
+
+    ambiguous = sum(row[-2] > 1 for row in rows)
+    matched = nkeys - len(rows)
+    match_rate = matched / nkeys * 100 if nkeys else 100.0
+    log.info(f"Pre-flight: {matched} of {nkeys} keys match one object ({match_rate:.1f}%), "
+             f"{len(rows) - ambiguous} have no match, {ambiguous} match several")
+
+    if rows:
+        report_path = output_dir / report_name
+        with open(report_path, 'w', newline='') as report_file:
+            writer = csv.writer(report_file, lineterminator='\n')
+            writer.writerow((['Gear_Sheet'] if sheets else []) + ['key', 'problem', 'matches', 'ids'])
+            writer.writerows(rows)
+        log.warning(f"{len(rows)} keys will fail, listed in {report_name}")
+
+    if match_rate < min_match_rate:
+        log.error(f"Only {match_rate:.1f}% of the keys match one object, below min_match_rate "
+                  f"{min_match_rate}%.  Nothing was written.")
+        raise Exception("Match rate below min_match_rate")
+
+    return nkeys
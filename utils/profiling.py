@@ -0,0 +1,129 @@
+import collections
+import cProfile
+import io
+import logging
+import pstats
+import re
+import sys
+import threading
+
+log = logging.getLogger("__main__")
+
+profile_modes = ['off', 'cprofile', 'sampling']
+profile_name = 'Data_Import_profile'
+
+# Seconds between stack samples in sampling mode
+sample_interval = 0.01
+# Functions listed in the text summaries
+top_functions = 40
+
+
+class CProfiler:
+    # Deterministic profile of the main thread.  Time the main thread spends waiting
+    # on the update workers shows up as lock waits.
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def save(self, output_dir):
+        stats_path = output_dir / f"{profile_name}.pstats"
+        self._profile.dump_stats(stats_path)
+
+        text = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=text)
+        stats.sort_stats('cumulative').print_stats(top_functions)
+        stats.sort_stats('tottime').print_stats(top_functions)
+        text_path = output_dir / f"{profile_name}.txt"
+        text_path.write_text(text.getvalue())
+
+        return [stats_path, text_path]
+
+
+class SamplingProfiler:
+    # Samples the stack of every thread (update workers, discovery, logging) from a
+    # background thread.  Cheap enough to leave on for a whole production job.
+    def __init__(self, interval=sample_interval):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            # Pool threads are numbered, count them together
+            names = {t.ident: re.sub(r'_\d+$', '', t.name) for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:"
+                                 f"{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, 'thread'))
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def save(self, output_dir):
+        # Folded stacks, one "thread;outer;...;inner count" line per stack, as read by
+        # flamegraph.pl and speedscope
+        folded_path = output_dir / f"{profile_name}.folded"
+        with open(folded_path, 'w') as folded_file:
+            for stack, count in self._stacks.most_common():
+                folded_file.write(f"{stack} {count}\n")
+
+        inclusive = collections.Counter()
+        exclusive = collections.Counter()
+        for stack, count in self._stacks.items():
+            frames = stack.split(';')[1:]
+            for function in set(frames):
+                inclusive[function] += count
+            if frames:
+                exclusive[frames[-1]] += count
+
+        total = sum(self._stacks.values()) or 1
+        lines = [f"{self.samples} samples every {self.interval}s of every thread's stack "
+                 f"({total} stacks), threads waiting on locks or requests included", '',
+                 'Most samples in the function or below it:']
+        lines += [f"  {count / total * 100:6.2f}%  {function}"
+                  for function, count in inclusive.most_common(top_functions)]
+        lines += ['', 'Most samples in the function itself:']
+        lines += [f"  {count / total * 100:6.2f}%  {function}"
+                  for function, count in exclusive.most_common(top_functions)]
+        text_path = output_dir / f"{profile_name}.txt"
+        text_path.write_text('\n'.join(lines) + '\n')
+
+        return [folded_path, text_path]
+
+
+def start_profiler(mode):
+    # Returns the running profiler, or None when profiling is off
+    if mode in (None, '', 'off'):
+        return None
+    if mode not in profile_modes:
+        raise Exception(f"Unknown profile mode {mode}, expected one of {', '.join(profile_modes)}")
+
+    profiler = CProfiler() if mode == 'cprofile' else SamplingProfiler()
+    profiler.start()
+    return profiler
+
+
+def stop_profiler(profiler, output_dir):
+    profiler.stop()
+    paths = profiler.save(output_dir)
+    log.info(f"Profile saved to {', '.join(p.name for p in paths)}")
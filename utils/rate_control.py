@@ -0,0 +1,189 @@
+import logging
+import random
+import threading
+import time
+
+from utils import instrumentation
+
+log = logging.getLogger("__main__")
+
+transient_status_codes = {429, 500, 502, 503, 504}
+# Responses that mean the site wants fewer requests, not that a request went wrong
+throttle_status_codes = {429, 503}
+
+# Attempts after the first one before a request's error is passed on.  Throttled
+# attempts count against their own, larger budget: they say "slow down", not "failed".
+max_retries = 6
+max_throttle_retries = 20
+# Retry delays grow from backoff seconds up to max_backoff, with full jitter
+backoff = 0.5
+max_backoff = 60.0
+# An endpoint is congested once its average latency is latency_factor times (plus
+# latency_slack seconds over) the fastest average seen for it
+latency_factor = 3.0
+latency_slack = 0.05
+# Weight of the latest request in an endpoint's average latency
+latency_weight = 0.2
+# The limit is multiplied by this on congestion
+decrease_factor = 0.7
+# Round trips taken to grow the limit by one past where the site last pushed back
+probe_round_trips = 4
+
+
+def is_transient(error):
+    # flywheel.ApiException carries the HTTP status, connection problems from
+    # requests/urllib3 are all OSError subclasses.
+    status = getattr(error, 'status', None)
+    if status is not None:
+        return status in transient_status_codes
+    return isinstance(error, OSError)
+
+
+def retry_after(error):
+    # Seconds the server asked us to wait, if it said
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateGovernor:
+    # Shared limit on the requests in flight, adjusted AIMD style: it doubles every
+    # round trip until the first sign of congestion, then grows by one per round trip
+    # (slower near the limit that last caused congestion) and shrinks, at most once
+    # per round trip, when the site throttles a request or latency climbs.  A
+    # Retry-After on a throttled request pauses every new request until then.
+    # Transient errors are retried with jittered exponential backoff.
+    def __init__(self, max_concurrency, retries=max_retries):
+        self.max_concurrency = max(1, max_concurrency)
+        self.retries = retries
+        self.limit = 1.0
+        self.threshold = float(self.max_concurrency)
+        # Limit at the last congestion, growth slows down around it
+        self.ceiling = None
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.retried = 0
+        self.decreases = 0
+        self.lowest_limit = self.limit
+        self._latency = {}
+        self._fastest = {}
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def call(self, endpoint, request):
+        errors = 0
+        throttles = 0
+        while True:
+            full = self._acquire()
+            start = time.monotonic()
+            try:
+                result = request()
+            except Exception as e:
+                self._release()
+                if getattr(e, 'status', None) in throttle_status_codes:
+                    throttles += 1
+                else:
+                    errors += 1
+                if not is_transient(e) or errors > self.retries or throttles > max_throttle_retries:
+                    raise
+                delay = self._on_error(e, errors + throttles - 1)
+                log.debug('transient error on %s: %s. Retrying in %.1fs', endpoint, e, delay)
+                time.sleep(delay)
+                continue
+            self._release()
+            self._on_success(endpoint, time.monotonic() - start, full)
+            return result
+
+    def _acquire(self):
+        # Returns whether this request filled the limit, only then does a success show
+        # that the site can take more
+        with self._condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return self.in_flight >= int(self.limit)
+                self._condition.wait(wait if wait > 0 else None)
+
+    def _release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def _on_success(self, endpoint, seconds, full=True):
+        with self._condition:
+            average = self._latency.get(endpoint, seconds)
+            average += (seconds - average) * latency_weight
+            self._latency[endpoint] = average
+            fastest = min(self._fastest.get(endpoint, average), average)
+            self._fastest[endpoint] = fastest
+
+            if average > fastest * latency_factor + latency_slack:
+                self._decrease(average)
+            elif not full:
+                return
+            elif self.limit < self.threshold:
+                self.limit = min(self.limit + 1, self.max_concurrency)
+            elif self.ceiling is None or self.limit + 1 < self.ceiling:
+                self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+            else:
+                self.limit = min(self.limit + 1 / (self.limit * probe_round_trips),
+                                 self.max_concurrency)
+            self._condition.notify_all()
+
+    def _on_error(self, error, attempt):
+        # Returns the seconds to wait before retrying.  A throttled request that
+        # brought the limit down only needs to wait its turn under the new limit,
+        # anything else backs off exponentially.
+        delay = random.uniform(0, min(max_backoff, backoff * 2 ** min(attempt, 10)))
+        with self._condition:
+            self.retried += 1
+            if getattr(error, 'status', None) not in throttle_status_codes:
+                return delay
+            
+            self.throttled += 1
+            round_trip = max(self._latency.values(), default=latency_slack)
+            self._decrease(round_trip)
+            if self.limit > 1:
+                delay = random.uniform(0, 2 * round_trip)
+            wait = retry_after(error)
+            if wait is not None:
+                delay = max(delay, wait)
+                self.paused_until = max(self.paused_until, time.monotonic() + wait)
+        return delay
+
+    def _decrease(self, round_trip):
+        # Called with the condition held.  Requests already in flight when the limit
+        # was cut can't have seen the cut yet, so don't cut again for one round trip.
+        now = time.monotonic()
+        if self.limit <= 1 or now - self._last_decrease < round_trip:
+            return
+        self._last_decrease = now
+        self.ceiling = self.limit
+        self.limit = self.threshold = max(1.0, self.limit * decrease_factor)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+        self.decreases += 1
+        log.debug('API congestion, %d requests at a time', int(self.limit))
+
+    def report_lines(self):
+        with self._condition:
+            return [f"Rate control: {int(self.limit)}/{self.max_concurrency} requests at a time "
+                    f"(lowest {int(self.lowest_limit)}), {self.decreases} slowdowns, "
+                    f"{self.throttled} throttled, {self.retried} retried"]
+
+
+def govern_client(fw, max_concurrency, retries=max_retries):
+    governor = RateGovernor(max_concurrency, retries)
+
+    def governed(call_api):
+        def governed_call_api(resource_path, method, *args, **kwargs):
+            return governor.call(f"{method} {resource_path}",
+                                 lambda: call_api(resource_path, method, *args, **kwargs))
+        return governed_call_api
+
+    instrumentation.wrap_call_api(fw, governed)
+
+    return governor
@@ -0,0 +1,209 @@
+import csv
+import logging
+import re
+
+log = logging.getLogger("__main__")
+
+# pandas.read_table's default missing value markers (pandas 1.1)
+na_values = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+             '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null'}
+true_values = {'True', 'TRUE', 'true'}
+false_values = {'False', 'FALSE', 'false'}
+
+int_pattern = re.compile(r'\s*[+-]?\d+\s*$')
+float_pattern = re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$|\s*[+-]?inf(inity)?\s*$',
+                           re.IGNORECASE)
+
+
+class Column(list):
+    # A column's values, with the one Series method validate_df uses
+    def nunique(self):
+        return len({v for v in self if v is not None})
+
+
+class RowRecords:
+    # The rows of a table as dicts of native values.  Only the converted columns are
+    # held, a row's dict is built when the import gets to it, so a wide table isn't
+    # kept a second time as one dict per row.
+    def __init__(self, columns, values, nrows):
+        self.columns = columns
+        self._values = values
+        self._nrows = nrows
+
+    def __len__(self):
+        return self._nrows
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[p] for p in range(*position.indices(self._nrows))]
+        return dict(zip(self.columns, [values[position] for values in self._values]))
+
+    def __iter__(self):
+        return (self[position] for position in range(self._nrows))
+
+    def column(self, name):
+        # One column's values without building the rows, the last one of that name
+        # like in the row dicts
+        for column, values in zip(reversed(self.columns), reversed(self._values)):
+            if column == name:
+                return values
+        return [None] * self._nrows
+
+
+class RecordTable:
+    # Just enough of a DataFrame (columns, index, column get/set, to_csv...) for the
+    # import of a small text file read with the csv module, so pandas never has to be
+    # imported.  Values are converted per column the way pandas.read_table would.
+    def __init__(self, columns, rows):
+        self.columns = list(columns)
+        self._values = {c: Column(values) for c, values in zip(self.columns, zip(*rows))}
+        if not rows:
+            self._values = {c: Column() for c in self.columns}
+        self.index = range(len(rows))
+
+    @property
+    def shape(self):
+        return len(self.index), len(self.columns)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, column):
+        return column in self._values
+
+    def keys(self):
+        return self.columns
+
+    def __getitem__(self, column):
+        return self._values[column]
+
+    def __setitem__(self, column, values):
+        if column not in self._values:
+            self.columns.append(column)
+        self._values[column] = Column(values)
+
+    def drop(self, columns, errors='raise'):
+        missing = [c for c in columns if c not in self._values]
+        if missing and errors != 'ignore':
+            raise KeyError(f"{missing} not found in columns")
+        kept = [c for c in self.columns if c not in columns]
+        return RecordTable(kept, list(zip(*(self._values[c] for c in kept))) if kept else [])
+
+    def insert(self, position, column, value):
+        self.columns.insert(position, column)
+        self._values[column] = Column([value] * len(self))
+
+    def records(self, exclude_columns=()):
+        # The rows like import_data.prepare_records
+        columns = [c for c in self.columns if c not in exclude_columns]
+        return RowRecords(columns, [self._values[c] for c in columns], len(self))
+
+    def to_csv(self, path, index=False, mode='w', header=True):
+        with open(path, mode, newline='') as csv_file:
+            writer = csv.writer(csv_file, lineterminator='\n')
+            if header:
+                writer.writerow(self.columns)
+            writer.writerows(zip(*(self._values[c] for c in self.columns)))
+
+
+def integer(value):
+    # pandas' nullable Int64 also takes integral floats like '2.0'
+    if int_pattern.match(value):
+        return int(value)
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(f"cannot convert {value!r} to int")
+    return int(number)
+
+
+def boolean(value):
+    if value in true_values or value.strip() in ('1', '1.0'):
+        return True
+    if value in false_values or value.strip() in ('0', '0.0'):
+        return False
+    raise ValueError(f"cannot convert {value!r} to bool")
+
+
+# load_data.column_types names -> conversion of one present value, like the dtypes
+# read_table is given for them
+typed_conversions = {
+    'str': str,
+    'category': str,
+    'int': integer,
+    'float': float,
+    'bool': boolean,
+}
+
+
+def convert_column(values, type_name=None):
+    # Same types pandas infers: bool, int (float once a value is missing), float, or
+    # the strings as they are, unless the column has a type.  Missing values are None.
+    if type_name is not None:
+        convert = typed_conversions[type_name]
+        return [None if v in na_values else convert(v) for v in values]
+
+    present = [v for v in values if v not in na_values]
+    if not present:
+        return [None] * len(values)
+
+    missing = len(present) != len(values)
+    if all(v in true_values or v in false_values for v in present):
+        return [None if v in na_values else v in true_values for v in values]
+    if all(int_pattern.match(v) for v in present):
+        convert = float if missing else int
+        return [None if v in na_values else convert(int(v)) for v in values]
+    if all(float_pattern.match(v) for v in present):
+        return [None if v in na_values else float(v) for v in values]
+    return [None if v in na_values else v for v in values]
+
+
+def header_names(header):
+    # Blank headers are 'Unnamed: <position>', repeated ones get a '.1', '.2'... suffix.
+    # Like pandas, suffixes that would give a name already in the header are skipped.
+    header = [name or f"Unnamed: {position}" for position, name in enumerate(header)]
+    taken = set(header)
+    used = set()
+    counts = {}
+    names = []
+    for name in header:
+        if name in used:
+            count = counts.get(name, 1)
+            while f"{name}.{count}" in taken:
+                count += 1
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            taken.add(name)
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def read_small_csv(path, firstrow_spec, delimiter, max_rows, column_types=None):
+    # RecordTable of the file, or None when it has more than max_rows rows or a layout
+    # that only pandas reads the same way (multi-character delimiters, rows longer
+    # than the header, dates)
+    column_types = column_types or {}
+    if len(delimiter) != 1 or 'datetime' in column_types.values():
+        return None
+
+    with open(path, newline='', encoding='utf-8-sig') as csv_file:
+        reader = csv.reader(csv_file, delimiter=delimiter)
+        lines = (line for line in reader if line)
+        for _ in range(firstrow_spec - 1):
+            next(lines, None)
+        header = next(lines, None)
+        if header is None:
+            return None
+
+        rows = []
+        for line in lines:
+            if len(rows) >= max_rows or len(line) > len(header):
+                return None
+            rows.append(line + [''] * (len(header) - len(line)))
+
+    names = header_names(header)
+    columns = [convert_column(list(values), column_types.get(name))
+               for name, values in zip(names, zip(*rows))]
+    log.debug(f"Read {len(rows)} rows with the csv module")
+
+    return RecordTable(names, list(zip(*columns)) if rows else [])
@@ -0,0 +1,110 @@
+import collections
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+log = logging.getLogger("__main__")
+
+log_formats = ['verbose', 'compact']
+
+# Seconds between progress lines in compact mode
+progress_interval = 30
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats the whole record before queueing it.  Records
+    # are only handed to a listener thread in this process, so only the message is
+    # merged here, while its arguments still hold the values being logged.  The
+    # formatter, tracebacks and the I/O are left to that thread.
+    def __init__(self, log_queue, handlers):
+        super().__init__(log_queue)
+        # The listener's handlers, for processes forked while the queue is in use
+        self.target_handlers = handlers
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def start_queue_logging():
+    # Moves the root logger's handlers behind a queue so writing the log doesn't
+    # hold up the import.  Returns the listener, stop it to flush the queue.
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    log_queue = queue.SimpleQueue()
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue, handlers))
+    listener.start()
+
+    return listener
+
+
+def stop_queue_logging(listener):
+    root = logging.getLogger()
+    listener.stop()
+    for handler in list(root.handlers):
+        if isinstance(handler, DeferredQueueHandler):
+            root.removeHandler(handler)
+    for handler in listener.handlers:
+        root.addHandler(handler)
+
+
+def detach_queue_logging():
+    # In a forked process the listener thread doesn't exist, log straight to the
+    # handlers it was writing to instead.
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DeferredQueueHandler):
+            root.removeHandler(handler)
+            for target in handler.target_handlers:
+                root.addHandler(target)
+
+
+class ImportProgress:
+    # Counts row outcomes and logs a throughput summary every progress_interval
+    # seconds.  Outcomes of queued writes arrive from the writer threads.
+    def __init__(self, total=None, interval=progress_interval):
+        self.total = total
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._last_report = self._start
+
+    def update(self, status):
+        with self._lock:
+            self.counts[status] += 1
+            now = time.monotonic()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+            line = self._summary(now)
+        log.info(line)
+
+    def finish(self):
+        with self._lock:
+            line = self._summary(time.monotonic())
+        log.info(line)
+
+    def _summary(self, now):
+        done = sum(self.counts.values())
+        elapsed = now - self._start
+        rate = done / elapsed if elapsed else 0
+        total = f"/{self.total} ({done / self.total * 100:.1f}%)" if self.total else ''
+        statuses = ', '.join(f"{status} {count}" for status, count in sorted(self.counts.items()))
+        return f"Progress: {done}{total} rows, {rate:.0f} rows/s, {statuses}"
+
+
+def log_row(row, key, status, location=None, reason=None):
+    # One line per row, formatted lazily by the logging thread
+    if reason is None:
+        log.info('row=%s status=%s key=%r location=%r', row, status, key, location)
+    else:
+        log.info('row=%s status=%s key=%r location=%r reason=%r',
+                 row, status, key, location, str(reason))
@@ -0,0 +1,142 @@
+import concurrent.futures
+import logging
+import zlib
+
+from utils import flywheel_helpers as fh, import_data as id, discovery, instrumentation
+from utils import journal as jn, rate_control, row_logging as rl
+
+log = logging.getLogger("__main__")
+
+
+def shard_of(key, shards):
+    # Stable across processes and runs, unlike hash()
+    return zlib.crc32(str(key).encode('utf-8')) % shards
+
+
+def partition(df, mapping_column, shards):
+    # Row labels of each shard, in their original order
+    labels = [[] for _ in range(shards)]
+    for label, key in zip(df.index, df[mapping_column]):
+        labels[shard_of(key, shards)].append(label)
+    return labels
+
+
+def hydrate_shard(fw, records):
+    # Full objects for the records a shard matched.  Records that can't be found
+    # stay records and are fetched (or fail) row by row in import_data.
+    hydrated = discovery.hydrate_matches(fw, records)
+    return [hydrated.get(fh.get_id(r), r) for r in records]
+
+
+def import_shard(shard_number,
+                 api_key,
+                 df,
+                 mapping_column,
+                 records,
+                 options,
+                 journal_path=None,
+                 completed=None,
+                 sheet=None):
+
+    # Runs in a worker process with its own client.  Returns the shard's frame with
+    # its status columns and the API calls it made.
+    import flywheel
+
+    rl.detach_queue_logging()
+    log.info(f"Shard {shard_number}: importing {len(df)} rows")
+
+    fw = flywheel.Client(api_key)
+    stats = instrumentation.instrument_client(fw)
+    rate_control.govern_client(fw, options['max_workers'])
+
+    journal = None
+    if journal_path is not None:
+        journal = jn.ImportJournal(journal_path, options['metadata_destination'])
+        journal.sheet = sheet
+
+    try:
+        objects = hydrate_shard(fw, records)
+        container_index = fh.build_mapping_index(fw, objects, options['mapping_type'],
+                                                 options['attached_files'])
+
+        df = id.import_data(fw,
+                            df,
+                            mapping_column,
+                            objects,
+                            options['attached_files'],
+                            options['metadata_destination'],
+                            options['overwrite'],
+                            options['dry_run'],
+                            options['max_workers'],
+                            container_index=container_index,
+                            final_report=False,
+                            journal=journal,
+                            completed=completed,
+                            log_format=options['log_format'])
+    finally:
+        if journal is not None:
+            journal.close()
+
+    log.info(f"Shard {shard_number}: done")
+
+    return df, stats.export()
+
+
+def import_sharded(fw,
+                   api_key,
+                   df,
+                   mapping_column,
+                   container_index,
+                   shards,
+                   options,
+                   journal=None,
+                   completed=None,
+                   api_stats=None):
+
+    # Splits the rows by a hash of the mapping key and imports each part in its own
+    # process.  Each shard gets the (slim) records matching its keys, so discovery
+    # still happens once.  Statuses come back in the original row order.
+    shard_labels = partition(df, mapping_column, shards)
+    log.info(f"Importing {len(df)} rows in {shards} processes "
+             f"({', '.join(str(len(labels)) for labels in shard_labels)} rows)")
+
+    # max_workers is the limit for the whole import, each process governs its share
+    max_workers = max(1, options['max_workers'] // shards)
+    if max_workers * shards > options['max_workers']:
+        log.info(f"max_workers {options['max_workers']} is below shards, every process "
+                 f"still sends one update at a time")
+    options = dict(options, max_workers=max_workers)
+
+    journal_path = journal.path if journal is not None else None
+    sheet = journal.sheet if journal is not None else None
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=shards) as executor:
+        futures = []
+        for shard_number, labels in enumerate(shard_labels):
+            if not labels:
+                continue
+            shard_df = df.loc[labels]
+            keys = set(shard_df[mapping_column])
+            records = [fh.to_record(c) for key in keys for c in fh.find_in_index(container_index, key)]
+            shard_completed = ({k: v for k, v in completed.items() if shard_of(k, shards) == shard_number}
+                               if completed else None)
+            futures.append(executor.submit(import_shard,
+                                           shard_number,
+                                           api_key,
+                                           shard_df,
+                                           mapping_column,
+                                           records,
+                                           options,
+                                           journal_path,
+                                           shard_completed,
+                                           sheet))
+
+        frames = []
+        for future in futures:
+            shard_df, latencies = future.result()
+            frames.append(shard_df)
+            if api_stats is not None:
+                api_stats.merge(latencies)
+
+    import pandas as pd
+    return pd.concat(frames).loc[df.index]
@@ -0,0 +1,157 @@
+import json
+import logging
+import sqlite3
+from pathlib import Path
+
+from utils import flywheel_helpers as fh
+
+log = logging.getLogger("__main__")
+
+snapshot_name = 'hierarchy_snapshot.sqlite'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS containers (
+    id TEXT PRIMARY KEY,
+    project TEXT,
+    container_type TEXT,
+    label TEXT,
+    parents TEXT,
+    modified TEXT
+);
+CREATE INDEX IF NOT EXISTS containers_level ON containers (project, container_type);
+CREATE TABLE IF NOT EXISTS files (
+    parent_id TEXT,
+    name TEXT,
+    file_id TEXT,
+    PRIMARY KEY (parent_id, name)
+);
+CREATE TABLE IF NOT EXISTS stale_files (
+    parent_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS refreshes (
+    project TEXT,
+    container_type TEXT,
+    modified TEXT,
+    PRIMARY KEY (project, container_type)
+);
+'''
+
+
+def timestamp(value):
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+class HierarchySnapshot:
+    # On-disk copy of the id, label/name, parents and modified time of every container
+    # (and file name) in a project, kept between gear runs.  Each run only asks
+    # flywheel for containers modified since the newest one in the snapshot.
+    #
+    # Containers deleted from flywheel are not noticed by the incremental refresh.
+    # Rows matching them fail when the container is fetched, delete the snapshot file
+    # to rebuild it from scratch.
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path))
+        self._db.executescript(schema)
+
+    def close(self):
+        self._db.close()
+
+    def last_modified(self, project_id, level):
+        row = self._db.execute(
+            'SELECT modified FROM refreshes WHERE project = ? AND container_type = ?',
+            (project_id, level)).fetchone()
+        return row[0] if row else None
+
+    def refresh(self, fw, project, level):
+        since = self.last_modified(project.id, level)
+        query = f"parents.project={project.id}"
+        if since is not None:
+            # Inclusive, containers sharing the newest timestamp are found again and
+            # skipped below
+            query += f",modified>={since}"
+
+        # Returns records of the containers that changed.  Finds leave out files, so
+        # the file lists of changed containers are marked stale in the same
+        # transaction as the new timestamp, until store_files replaces them.
+        finder = getattr(fw, f"{level}s")
+        newest = since
+        changed = []
+        with self._db:
+            for container in finder.iter_find(query):
+                modified = timestamp(container.get('modified'))
+                if modified is not None and modified == self._stored_modified(container.id):
+                    continue
+                self._store(project.id, container)
+                self._db.execute('INSERT OR REPLACE INTO stale_files VALUES (?)', (container.id,))
+                if modified is not None and (newest is None or modified > newest):
+                    newest = modified
+                changed.append(fh.to_record(container))
+
+            self._db.execute('INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?)',
+                             (project.id, level, newest))
+
+        log.info(f"Snapshot: {len(changed)} {level} containers "
+                 f"{'changed since ' + since if since else 'loaded'}")
+        
+        return changed
+
+    def _stored_modified(self, container_id):
+        row = self._db.execute('SELECT modified FROM containers WHERE id = ?',
+                               (container_id,)).fetchone()
+        return row[0] if row else None
+
+    def _store(self, project_id, container):
+        parents = {k: getattr(container.parents, k, None) for k in fh.Parents._fields}
+        self._db.execute('INSERT OR REPLACE INTO containers VALUES (?, ?, ?, ?, ?, ?)',
+                         (container.id,
+                          project_id,
+                          container.container_type,
+                          container.label,
+                          json.dumps(parents),
+                          timestamp(container.get('modified'))))
+
+    def store_files(self, containers):
+        with self._db:
+            for container in containers:
+                self._db.execute('DELETE FROM files WHERE parent_id = ?', (container.id,))
+                self._db.execute('DELETE FROM stale_files WHERE parent_id = ?', (container.id,))
+                self._db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                                     [(container.id, f.name, f.get('file_id'))
+                                      for f in container.files or []])
+
+    def load(self, project_id, level):
+        rows = self._db.execute(
+            'SELECT id, label, parents FROM containers WHERE project = ? AND container_type = ?',
+            (project_id, level))
+        return [fh.ContainerRecord(container_id, level, label, fh.Parents(**json.loads(parents)))
+                for container_id, label, parents in rows]
+
+    def stale_files(self, containers):
+        # Ids of the containers whose file list is out of date
+        stale = set()
+        for start in range(0, len(containers), 500):
+            ids = [c.id for c in containers[start:start + 500]]
+            rows = self._db.execute(
+                f"SELECT parent_id FROM stale_files WHERE parent_id IN ({','.join('?' * len(ids))})",
+                ids)
+            stale.update(parent_id for parent_id, in rows)
+        return stale
+
+    def load_files(self, containers):
+        by_id = {c.id: c for c in containers}
+        files = []
+        for start in range(0, len(containers), 500):
+            ids = [c.id for c in containers[start:start + 500]]
+            rows = self._db.execute(
+                f"SELECT parent_id, name, file_id FROM files "
+                f"WHERE parent_id IN ({','.join('?' * len(ids))})", ids)
+            for parent_id, name, file_id in rows:
+                files.append(fh.ContainerRecord(file_id, 'file', name=name,
+                                                parent=by_id[parent_id], file_id=file_id))
+        return files